@@ -0,0 +1,186 @@
+import math
+import time
+
+
+# Software LED animations, drawn at a fixed frame rate from the ViewSet loop:
+#   animator = Animator(viewset, fps=30)
+#   animator.add(Chase(GridControlSet(0, 0, 7, 0).all(controller), 'red'))
+
+
+class Animation:
+    # Subclasses implement frame(t), returning {(group, control): color} for
+    # t seconds since the animation started
+    def __init__(self, cells, duration=None):
+        self.cells = list(cells)
+        self.duration = duration
+        self.start = None
+
+    def frame(self, t):
+        raise NotImplementedError()
+
+    def done(self, t):
+        return self.duration is not None and t >= self.duration
+
+
+def _rgb(rgb, fast=False):
+    # With fast, the device's nearest palette color is used (see
+    # ControllerBase._quantize), which is cheaper to send and works on
+    # controllers without RGB LEDs
+    color = '#{:02x}{:02x}{:02x}'.format(*map(lambda v: max(0, min(255, int(v))), rgb))
+    return (color + ' fast') if fast else color
+
+
+class Chase(Animation):
+    # A block of length lit cells moving along cells, speed cells per second
+    def __init__(self, cells, color='on', off_color='off', length=1, speed=8, **kwargs):
+        super().__init__(cells, **kwargs)
+        self.color = color
+        self.off_color = off_color
+        self.length = length
+        self.speed = speed
+
+    def frame(self, t):
+        pos = int(t * self.speed) % len(self.cells)
+        lit = set((pos - i) % len(self.cells) for i in range(self.length))
+        return {cell: (self.color if i in lit else self.off_color) for i, cell in enumerate(self.cells)}
+
+
+class Pulse(Animation):
+    # Fade an RGB color (0-255 per channel) in and out, period in seconds
+    def __init__(self, cells, rgb=(255, 255, 255), period=1.0, fast=False, **kwargs):
+        super().__init__(cells, **kwargs)
+        self.rgb = rgb
+        self.period = period
+        self.fast = fast
+
+    def frame(self, t):
+        level = (1 - math.cos((t / self.period) * 2 * math.pi)) / 2
+        color = _rgb((v * level for v in self.rgb), self.fast)
+        return {cell: color for cell in self.cells}
+
+
+class Gradient(Animation):
+    # An RGB gradient from start to end across cells, scrolling once every
+    # period seconds (or not moving if period is None)
+    def __init__(self, cells, start=(255, 0, 0), end=(0, 0, 255), period=None, fast=False, **kwargs):
+        super().__init__(cells, **kwargs)
+        self.start_rgb = start
+        self.end_rgb = end
+        self.period = period
+        self.fast = fast
+
+    def frame(self, t):
+        offset = (t / self.period) if self.period else 0
+        out = {}
+        for i, cell in enumerate(self.cells):
+            # 0 -> 1 -> 0 so the gradient wraps around smoothly
+            pos = ((i / len(self.cells)) + offset) % 1
+            pos = 1 - abs((pos * 2) - 1)
+            out[cell] = _rgb((a + ((b - a) * pos) for a, b in zip(self.start_rgb, self.end_rgb)), self.fast)
+        return out
+
+
+class Meter(Animation):
+    # A level meter along cells (first cell is the bottom), value is called
+    # each frame and returns 0-1. colors are spread along the meter like
+    # VirtualFader's.
+    def __init__(self, cells, value, colors=('green', 'yellow', 'red'), off_color='off', **kwargs):
+        super().__init__(cells, **kwargs)
+        self.value = value
+        self.off_color = off_color
+        per_color = math.ceil(len(self.cells) / len(colors))
+        self.colors = [c for c in colors for _ in range(per_color)]
+
+    def frame(self, t):
+        lit = round(max(0, min(1, self.value())) * len(self.cells))
+        return {cell: (self.colors[i] if i < lit else self.off_color) for i, cell in enumerate(self.cells)}
+
+
+class Animator:
+    # Draws animations at a fixed frame rate. Frames that are late are
+    # skipped rather than drawn back to back, as are frames while the
+    # controller's output thread has more than max_pending updates queued.
+    def __init__(self, viewset, fps=30, max_pending=4):
+        self.viewset = viewset
+        self.controller = viewset.controller
+        self.interval = 1 / fps
+        self.max_pending = max_pending
+        self.animations = []
+        # animation -> the last frame drawn for it
+        self._frames = {}
+        self.next_frame = None
+        self.frames = 0
+        self.dropped = 0
+
+    def add(self, animation):
+        animation.start = None
+        self.animations.append(animation)
+        if len(self.animations) == 1:
+            self.next_frame = time.monotonic()
+            self.viewset.add_ticker(self)
+        return animation
+
+    def remove(self, animation):
+        if animation in self.animations:
+            self.animations.remove(animation)
+            self._ended([animation])
+
+    def stop(self):
+        ended, self.animations = self.animations, []
+        self._ended(ended)
+
+    def _ended(self, animations):
+        # Put back what's under animations that have been removed or are
+        # done: off, with the view rendered over that (it may not have all
+        # of the pads) and the animations still running over that, in one
+        # batch so only pads that end up different are sent
+        if not self.animations:
+            self.next_frame = None
+            self.viewset.remove_ticker(self)
+        with self.controller.batch():
+            for animation in animations:
+                self._frames.pop(animation, None)
+                for group, control in animation.cells:
+                    self.controller.set_color(group, control, 'off')
+            self.viewset.render()
+            for animation in self.animations:
+                for (group, control), color in self._frames.get(animation, {}).items():
+                    self.controller.set_color(group, control, color)
+
+    def next_deadline(self):
+        return self.next_frame
+
+    def tick(self, now):
+        if self.next_frame is None or now < self.next_frame:
+            return
+        self.next_frame += self.interval
+        if self.next_frame <= now:
+            # Fell behind, skip the frames that were missed
+            missed = int((now - self.next_frame) / self.interval) + 1
+            self.dropped += missed
+            self.next_frame += missed * self.interval
+
+        if self.max_pending is not None and self.controller.output_pending > self.max_pending:
+            self.dropped += 1
+            return
+
+        frame = {}
+        ended = []
+        for animation in list(self.animations):
+            if animation.start is None:
+                animation.start = now
+            t = now - animation.start
+            if animation.done(t):
+                self.animations.remove(animation)
+                ended.append(animation)
+                continue
+            self._frames[animation] = animation.frame(t)
+            frame.update(self._frames[animation])
+
+        # Only LEDs that differ from the last frame are actually sent
+        with self.controller.batch():
+            for (group, control), color in frame.items():
+                self.controller.set_color(group, control, color)
+            if ended:
+                self._ended(ended)
+        self.frames += 1
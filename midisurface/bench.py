@@ -0,0 +1,328 @@
+import argparse
+import json
+import statistics
+import sys
+import time
+
+from .control import ControlSet, GridControlSet, Toggle, Momentary, Radio, Fader, VirtualFader, ToggleMatrix
+from .animation import Gradient
+from .controller.akai import APCMini
+from .controller.novation import LaunchpadMK2
+from .port import VirtualPort
+from .view import ViewSet, View
+
+
+# Benchmarks for the dispatch and render paths, run against VirtualPorts so
+# no device is needed:
+#   python -m midisurface.bench [-n ITERATIONS] [--json OUT] [--compare BASELINE]
+
+BENCHMARKS = {}
+
+
+def benchmark(fn):
+    BENCHMARKS[fn.__name__] = fn
+    return fn
+
+
+def make_controller(cls, **kwargs):
+    port = VirtualPort(cls.PORT_NAME)
+    return cls(port=port, **kwargs), port
+
+
+def grid_cells(controller):
+    w, h = controller._GRID_SIZE
+    return [(x, y) for y in range(h) for x in range(w)]
+
+
+def toggle_grid_view(controller, name='toggles'):
+    # One Toggle per pad, the worst case for per-message dispatch
+    controls = [
+        Toggle(f'{name}-{x}-{y}', ControlSet([('GRID', (x, y))]), states=4, colors=['off', 'red', 'green', 'blue'])
+        for x, y in grid_cells(controller)
+    ]
+    return View(name, *controls)
+
+
+def toggle_matrix_view(controller, name='matrix'):
+    # The same as toggle_grid_view with one ToggleMatrix
+    w, h = controller._GRID_SIZE
+    return View(name, ToggleMatrix(name, 0, 0, w - 1, h - 1, states=4, colors=['off', 'red', 'green', 'blue']))
+
+
+def mixed_view(controller, name='mixed'):
+    controls = [
+        Radio(name + '-radio', ControlSet([('RIGHT', None)])),
+        Momentary(name + '-nav', ControlSet([('NAV', None)])),
+        Toggle(name + '-toggles', GridControlSet(0, 0, 3, 7), colors=['off', 'yellow']),
+    ]
+    for x in range(4, 8):
+        controls.append(VirtualFader(f'{name}-vf{x}', GridControlSet(x, 0, x, 7), colors=['green', 'yellow', 'red']))
+    return View(name, *controls)
+
+
+def fader_bank_view(controller, name='faders'):
+    controls = [Fader(f'{name}-{i}', ControlSet([('FADER', i)])) for i in range(9)]
+    controls.append(Toggle(name + '-toggles', GridControlSet(0, 0, 7, 7), colors=['off', 'green']))
+    return View(name, *controls)
+
+
+def timed(fn, iterations):
+    out = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        out.append(time.perf_counter() - start)
+    return out
+
+
+def timed_each(fn, items):
+    out = []
+    for item in items:
+        start = time.perf_counter()
+        fn(item)
+        out.append(time.perf_counter() - start)
+    return out
+
+
+def _dispatch_grid(iterations, make_view):
+    controller, port = make_controller(LaunchpadMK2)
+    viewset = ViewSet(controller)
+    viewset.push(make_view(controller))
+    messages = []
+    for x, y in grid_cells(controller):
+        messages.append(controller._input_message('GRID', (x, y), 127))
+        messages.append(controller._input_message('GRID', (x, y), 0))
+    messages = [msg.bytes() for msg in messages] * max(1, iterations // len(messages))
+
+    def one(data):
+        port.feed_raw(data)
+        viewset.dispatch()
+
+    return timed_each(one, messages)
+
+
+@benchmark
+def dispatch_toggle_grid(iterations):
+    return _dispatch_grid(iterations, toggle_grid_view)
+
+
+@benchmark
+def dispatch_toggle_matrix(iterations):
+    return _dispatch_grid(iterations, toggle_matrix_view)
+
+
+@benchmark
+def dispatch_mixed(iterations):
+    controller, port = make_controller(LaunchpadMK2)
+    viewset = ViewSet(controller)
+    viewset.push(mixed_view(controller))
+    messages = []
+    for x, y in grid_cells(controller):
+        messages.append(controller._input_message('GRID', (x, y), 127))
+        messages.append(controller._input_message('GRID', (x, y), 0))
+    for group, control in LaunchpadMK2._BTN_MAP.values():
+        messages.append(controller._input_message(group, control, 127))
+        messages.append(controller._input_message(group, control, 0))
+    messages = [msg.bytes() for msg in messages] * max(1, iterations // len(messages))
+
+    def one(data):
+        port.feed_raw(data)
+        viewset.dispatch()
+
+    return timed_each(one, messages)
+
+
+def _fader_sweep(iterations, coalesce):
+    controller, port = make_controller(APCMini)
+    viewset = ViewSet(controller)
+    viewset.push(fader_bank_view(controller))
+    sweep = []
+    for value in list(range(128)) + list(range(127, -1, -1)):
+        for fader in range(9):
+            sweep.append(controller._input_message('FADER', fader, value).bytes())
+
+    def one():
+        port.feed_raw(*sweep)
+        viewset.dispatch(coalesce=coalesce)
+
+    # Time per message in the sweep
+    return [t / len(sweep) for t in timed(one, max(5, iterations // 200))]
+
+
+@benchmark
+def dispatch_fader_sweep(iterations):
+    return _fader_sweep(iterations, False)
+
+
+@benchmark
+def dispatch_fader_sweep_coalesced(iterations):
+    return _fader_sweep(iterations, True)
+
+
+@benchmark
+def render_full(iterations):
+    controller, port = make_controller(LaunchpadMK2)
+    view = mixed_view(controller)
+
+    def one():
+        controller.invalidate()
+        view.render(controller)
+
+    return timed(one, iterations)
+
+
+@benchmark
+def render_toggle_grid(iterations):
+    controller, port = make_controller(LaunchpadMK2)
+    view = toggle_grid_view(controller)
+
+    def one():
+        controller.invalidate()
+        view.render(controller)
+
+    return timed(one, iterations)
+
+
+@benchmark
+def render_toggle_matrix(iterations):
+    controller, port = make_controller(LaunchpadMK2)
+    view = toggle_matrix_view(controller)
+
+    def one():
+        controller.invalidate()
+        view.render(controller)
+
+    return timed(one, iterations)
+
+
+def _render_rgb(iterations, fast):
+    controller, port = make_controller(LaunchpadMK2)
+    frames = [
+        Gradient([('GRID', cell) for cell in grid_cells(controller)], period=1, fast=fast).frame(i / 32)
+        for i in range(32)
+    ]
+    frames = frames * max(1, iterations // len(frames))
+
+    def one(frame):
+        with controller.batch():
+            for (group, control), color in frame.items():
+                controller.set_color(group, control, color)
+
+    return timed_each(one, frames)
+
+
+@benchmark
+def render_rgb(iterations):
+    return _render_rgb(iterations, False)
+
+
+@benchmark
+def render_rgb_fast(iterations):
+    return _render_rgb(iterations, True)
+
+
+@benchmark
+def render_unchanged(iterations):
+    controller, port = make_controller(LaunchpadMK2)
+    view = toggle_grid_view(controller)
+    view.render(controller)
+    return timed(lambda: view.render(controller), iterations)
+
+
+@benchmark
+def push_pop(iterations):
+    controller, port = make_controller(LaunchpadMK2)
+    viewset = ViewSet(controller)
+    viewset.push(toggle_grid_view(controller))
+    other = mixed_view(controller)
+    for x, y in grid_cells(controller)[::3]:
+        port.press(controller, 'GRID', (x, y))
+        port.release(controller, 'GRID', (x, y))
+    viewset.dispatch()
+
+    def one():
+        viewset.push(other)
+        viewset.pop()
+
+    return timed(one, iterations)
+
+
+@benchmark
+def reset(iterations):
+    controller, port = make_controller(LaunchpadMK2)
+
+    def one():
+        controller.invalidate()
+        controller.reset()
+
+    return timed(one, iterations)
+
+
+def summarize(times):
+    times = sorted(times)
+    return {
+        'ops': len(times),
+        'ops_per_sec': len(times) / sum(times) if sum(times) else 0,
+        'mean_us': statistics.mean(times) * 1e6,
+        'p50_us': times[len(times) // 2] * 1e6,
+        'p99_us': times[min(len(times) - 1, int(len(times) * 0.99))] * 1e6,
+    }
+
+
+def run(names=None, iterations=2000):
+    results = {}
+    for name, fn in BENCHMARKS.items():
+        if names and name not in names:
+            continue
+        fn(max(1, iterations // 10))  # Warm up caches
+        results[name] = summarize(fn(iterations))
+    return results
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for name, res in results.items():
+        if name not in baseline:
+            continue
+        if res['mean_us'] > baseline[name]['mean_us'] * (1 + tolerance):
+            regressions.append(name)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark midisurface dispatch and rendering")
+    parser.add_argument('benchmarks', nargs='*', help="Benchmarks to run, default all: " + ', '.join(BENCHMARKS))
+    parser.add_argument('-n', '--iterations', type=int, default=2000)
+    parser.add_argument('--json', help="Write results to this file")
+    parser.add_argument('--compare', help="Compare against results previously written with --json")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="Allowed slowdown vs. --compare (default 0.25 = 25%%)")
+    args = parser.parse_args(argv)
+
+    results = run(args.benchmarks, args.iterations)
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare, 'r') as fp:
+            baseline = json.load(fp)
+
+    print(f"{'benchmark':32} {'ops':>8} {'ops/s':>12} {'mean us':>10} {'p50 us':>10} {'p99 us':>10}")
+    for name, res in results.items():
+        line = f"{name:32} {res['ops']:8d} {res['ops_per_sec']:12.0f} {res['mean_us']:10.2f} {res['p50_us']:10.2f} {res['p99_us']:10.2f}"
+        if name in baseline:
+            line += f"  ({(res['mean_us'] / baseline[name]['mean_us'] - 1) * 100:+.1f}%)"
+        print(line)
+
+    if args.json:
+        with open(args.json, 'w') as fp:
+            json.dump(results, fp, indent=2)
+
+    if baseline:
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print("Regressions: " + ', '.join(regressions))
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,46 +1,121 @@
+import asyncio
+import collections
+import concurrent.futures
+import inspect
+import logging
+import threading
+import time
 import uuid
 import math
 
 
+logger = logging.getLogger(__name__)
+
+
 O_FIRST = -1000000
 O_LAST = 1000000
 
+# Time based events, only tracked for controls with callbacks for them:
+#   long_press (group, control): held for long_press_time
+#   repeat (group, control, count): every repeat_interval while held, after repeat_delay
+#   double_tap (group, control): pressed again within double_tap_time
+#   tap (group, control): released within long_press_time, and not pressed again
+#     within double_tap_time
+GESTURES = ('long_press', 'repeat', 'double_tap', 'tap')
+
+_tasks = set()
+
+
+def _run_coroutine(coro):
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        # Not running under an event loop (ViewSet.run), just run it to completion
+        asyncio.run(coro)
+        return
+    task = loop.create_task(coro)
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+
 
 class ControlSet(list):
+    # Incremented whenever any ControlSet is changed, see all() and
+    # View.dispatch
+    _changes = 0
+
     def test(self, group, control):
         for res in self:
             if isinstance(res, ControlSet):
-                return res.test(group, control)
+                if res.test(group, control):
+                    return True
+                continue
             t_group, t_control = res
             if t_group is None or t_group == group:
                 if t_control is None or t_control == control:
                     return True
         return False
 
-    def all(self, controller):
+    def _compile(self, controller):
         grouped = {}
         for group, control in controller._BTN_MAP.values():
             grouped.setdefault(group, []).append(control)
+        if controller.HAS_GRID:
+            w, h = controller._GRID_SIZE
+            grouped['GRID'] = [(x, y) for y in range(h) for x in range(w)]
+
+        out = []
         for res in self:
             if isinstance(res, ControlSet):
-                yield from res
+                out.extend(res.all(controller))
                 continue
             group, control = res
             if group is None:
                 for k in grouped:
                     if control is None:
                         for v in grouped[k]:
-                            yield k, v
+                            out.append((k, v))
                     else:
                         if control in grouped[k]:
-                            yield k, control
+                            out.append((k, control))
             elif control is None:
                 if group in grouped:
                     for v in grouped[group]:
-                        yield group, v
+                        out.append((group, v))
             else:
-                yield group, control
-        # TODO: when group is grid and control is None, yield all of those too
+                out.append((group, control))
+        return tuple(out)
+
+    def all(self, controller):
+        # Every (group, control) in the set, expanded for the controller's
+        # type once and then cached until any ControlSet (this one or a
+        # nested one) changes
+        cache = self.__dict__.setdefault('_compiled', {})
+        key = type(controller)
+        entry = cache.get(key)
+        if entry is not None and entry[0] == ControlSet._changes:
+            return entry[1]
+        members = self._compile(controller)
+        cache[key] = (ControlSet._changes, members, frozenset(members))
+        return members
+
+    def contains(self, controller, group, control):
+        self.all(controller)
+        return (group, control) in self._compiled[type(controller)][2]
+
+
+def _counts_change(name):
+    method = getattr(list, name)
+
+    def wrapper(self, *args, **kwargs):
+        ControlSet._changes += 1
+        return method(self, *args, **kwargs)
+    wrapper.__name__ = name
+    return wrapper
+
+
+for _name in ('append', 'extend', 'insert', 'remove', 'pop', 'clear', 'sort', 'reverse', '__setitem__', '__delitem__', '__iadd__', '__imul__'):
+    setattr(ControlSet, _name, _counts_change(_name))
+del _name
 
 
 class GridControlSet(ControlSet):
@@ -56,21 +131,40 @@ class GridControlSet(ControlSet):
         x, y = control
         return x >= self.x1 and y >= self.y1 and x <= self.x2 and y <= self.y2
 
-    def all(self, controller):
-        for y in range(self.y1, self.y2 + 1):
-            for x in range(self.x1, self.x2 + 1):
-                yield 'GRID', (x, y)
+    def cells(self):
+        # ('GRID', (x, y)) for each pad, row by row; the same for every
+        # controller, unlike all()
+        return tuple(('GRID', (x, y)) for y in range(self.y1, self.y2 + 1) for x in range(self.x1, self.x2 + 1))
+
+    def _compile(self, controller):
+        return self.cells()
 
 
 class Control:
     STORE_BY_ID = False
+    # Gesture timings in seconds, can also be set per instance
+    long_press_time = 0.5
+    double_tap_time = 0.3
+    repeat_delay = 0.5
+    repeat_interval = 0.1
 
     def __init__(self, name, controls, events=None):
         self.id = str(uuid.uuid4())
         self.name = name
         self.controls = controls
         self.events = {}
+        # event -> callbacks in call order, rebuilt when registrations change
+        self._chains = {}
         self.last_state = {}
+        # Callbacks waiting to run on an executor, run one at a time in order
+        self._jobs = collections.deque()
+        self._jobs_lock = threading.Lock()
+        self._job_running = False
+        # Whether there are callbacks for any GESTURES
+        self._gestures = False
+        # (group, control) -> pending timers, and time of the last press
+        self._timers = {}
+        self._last_press = {}
 
         for ev, callbacks in (events or {}).items():
             try:
@@ -79,55 +173,217 @@ class Control:
                 callbacks = [callbacks]
 
             for cb in callbacks:
+                executor = None
                 try:
-                    cb, order = cb
+                    cb, order, *executor = cb
                 except (TypeError, ValueError):
                     order = 0
 
-                self.on(ev, cb, order)
+                self.on(ev, cb, order, executor[0] if executor else None)
 
     def _process_value(self, controller, group, control, value):
         return value
 
     def dispatch(self, controller, group, control, value):
         if self.controls.test(group, control):
-            value = self._process_value(controller, group, control, value)
-            value_key = self.id if self.STORE_BY_ID else (group, control)
-            last_state = self.last_state.get(value_key)
-            self._emit(controller, self, 'raw', group, control, value)
-            if value and not last_state:
-                self._emit(controller, self, 'press', group, control)
-            elif not value and last_state:
-                self._emit(controller, self, 'release', group, control)
-            if value != last_state:
-                self._emit(controller, self, 'change', group, control, last_state, value)
-            if last_state is not None:
-                if value > last_state:
-                    self._emit(controller, self, 'up', group, control, last_state, value)
-                elif value < last_state:
-                    self._emit(controller, self, 'down', group, control, last_state, value)
-            self.last_state[value_key] = value
+            self._dispatch(controller, group, control, value)
+
+    def _dispatch(self, controller, group, control, value):
+        # Like dispatch, but the caller has already checked the control matches
+        value = self._process_value(controller, group, control, value)
+        value_key = self.id if self.STORE_BY_ID else (group, control)
+        last_state = self.last_state.get(value_key)
+        self._emit(controller, self, 'raw', group, control, value)
+        self._press_events(controller, group, control, last_state, value)
+        self._change_events(controller, group, control, last_state, value)
+        self.last_state[value_key] = value
+
+    def _press_events(self, controller, group, control, last_state, value):
+        # 'press' or 'release' (and gestures) for going from last_state to value
+        if value and not last_state:
+            self._on_press(controller, group, control)
+            self._emit(controller, self, 'press', group, control)
+            if self._gestures:
+                self._gesture_press(controller, group, control)
+        elif not value and last_state:
+            self._on_release(controller, group, control)
+            self._emit(controller, self, 'release', group, control)
+            if self._gestures:
+                self._gesture_release(controller, group, control)
+
+    def _change_events(self, controller, group, control, last_state, value):
+        # 'change', 'up' and 'down' for going from last_state to value
+        if value != last_state:
+            self._emit(controller, self, 'change', group, control, last_state, value)
+        if last_state is not None:
+            if value > last_state:
+                self._emit(controller, self, 'up', group, control, last_state, value)
+            elif value < last_state:
+                self._emit(controller, self, 'down', group, control, last_state, value)
+
+    def _on_press(self, controller, group, control):
+        # Run before the 'press' callbacks
+        pass
+
+    def _on_release(self, controller, group, control):
+        pass
 
     def render(self, controller):
         pass
 
-    def on(self, event, callback, order=0):
+    def on(self, event, callback, order=0, executor=None):
+        # With an executor (e.g. a concurrent.futures thread or process pool)
+        # the callback runs there instead of blocking dispatch. It is called
+        # as callback(event, group, control, *args), and its result or
+        # exception is emitted as a 'result' or 'error' event.
         id = event + ':' + str(uuid.uuid4())
+        if executor is not None:
+            callback = _Offloaded(callback, executor)
         self.events.setdefault(event, {})[id] = (order, callback)
+        self._chains.pop(event, None)
+        self._gestures = any(self.events.get(ev) for ev in GESTURES)
         return id
 
     def off(self, id):
-        event, id = ':'.split(id)
+        event = id.split(':', 1)[0]
         if event in self.events and id in self.events[event]:
             del self.events[event][id]
+            self._chains.pop(event, None)
+            self._gestures = any(self.events.get(ev) for ev in GESTURES)
+
+    def _gesture_press(self, controller, group, control):
+        key = (group, control)
+        self.cancel_gestures(key)
+        now = time.monotonic()
+        last = self._last_press.get(key)
+        if last is not None and now - last <= self.double_tap_time:
+            self._last_press.pop(key)
+            self._emit(controller, self, 'double_tap', group, control)
+        else:
+            self._last_press[key] = now
+        timers = []
+        if self.events.get('long_press'):
+            timers.append(controller.timers.call_at(now + self.long_press_time, self._emit, controller, self, 'long_press', group, control))
+        if self.events.get('repeat'):
+            timers.append(controller.timers.call_at(now + self.repeat_delay, self._repeat, controller, group, control, 1))
+        if timers:
+            self._timers[key] = timers
+
+    def _gesture_release(self, controller, group, control):
+        key = (group, control)
+        self.cancel_gestures(key)
+        # Not a tap if it was held long enough to be a long press
+        last = self._last_press.get(key)
+        if last is not None and self.events.get('tap') and time.monotonic() - last < self.long_press_time:
+            self._timers[key] = [controller.timers.call_at(last + self.double_tap_time, self._tap, controller, group, control)]
+
+    def _tap(self, controller, group, control):
+        self._timers.pop((group, control), None)
+        self._last_press.pop((group, control), None)
+        self._emit(controller, self, 'tap', group, control)
+
+    def _repeat(self, controller, group, control, count):
+        timers = self._timers.get((group, control))
+        if timers is not None:
+            timers[:] = [timer for timer in timers if timer.pending]
+            timers.append(controller.timers.call_later(self.repeat_interval, self._repeat, controller, group, control, count + 1))
+        self._emit(controller, self, 'repeat', group, control, count)
+
+    def cancel_gestures(self, key=None):
+        # Forget pending gestures for (group, control), or all of them, e.g.
+        # when the control is no longer showing so won't see the release
+        for timers in ([self._timers.pop(key, ())] if key is not None else self._timers.values()):
+            for timer in timers:
+                timer.cancel()
+        if key is None:
+            self._timers.clear()
+
+    def _get_chain(self, event):
+        chain = self._chains[event] = tuple(cb for _, cb in sorted(self.events.get(event, {}).values(), key=lambda v: v[0]))
+        return chain
 
     def _emit(self, controller, ctrl_instance, event, group, control, *args):
-        for _, cb in sorted(self.events.get(event, {}).values(), key=lambda v: v[0]):
+        try:
+            chain = self._chains[event]
+        except KeyError:
+            chain = self._get_chain(event)
+        if not chain:
+            return
+        stats = controller.stats
+        if stats is not None:
+            return self._emit_timed(stats, chain, controller, ctrl_instance, event, group, control, args)
+        for cb in chain:
             try:
-                cb(controller, ctrl_instance, event, group, control, *args)
-            except:
-                # TODO: log
-                pass
+                res = cb(controller, ctrl_instance, event, group, control, *args)
+                if inspect.isawaitable(res):
+                    _run_coroutine(res)
+            except Exception:
+                logger.exception("Error in %s callback for %s", event, self.name)
+
+    def _emit_timed(self, stats, chain, controller, ctrl_instance, event, group, control, args):
+        # _emit while a stats.Stats is attached to the controller
+        for cb in chain:
+            t = time.perf_counter()
+            try:
+                res = cb(controller, ctrl_instance, event, group, control, *args)
+                if inspect.isawaitable(res):
+                    _run_coroutine(res)
+            except Exception:
+                stats.errors += 1
+                logger.exception("Error in %s callback for %s", event, self.name)
+            stats._callback(self, event, cb, time.perf_counter() - t)
+
+    def _submit(self, controller, executor, callback, args):
+        with self._jobs_lock:
+            self._jobs.append((controller, executor, callback, args))
+            if self._job_running:
+                return
+            self._job_running = True
+        self._run_next_job()
+
+    def _run_next_job(self):
+        with self._jobs_lock:
+            if not self._jobs:
+                self._job_running = False
+                return
+            controller, executor, callback, args = self._jobs.popleft()
+        try:
+            future = executor.submit(callback, *args)
+        except Exception as e:
+            self._job_done(controller, args, None, e)
+        else:
+            future.add_done_callback(lambda f: self._future_done(controller, args, f))
+
+    def _future_done(self, controller, args, future):
+        # f.exception() raises for a cancelled future (e.g. the executor was
+        # shut down with cancel_futures), report that as the error instead
+        if future.cancelled():
+            exc = concurrent.futures.CancelledError()
+        else:
+            exc = future.exception()
+        self._job_done(controller, args, future, exc)
+
+    def _job_done(self, controller, args, future, exc):
+        # Called from the executor; report back on the dispatch thread
+        event, group, control = args[:3]
+        try:
+            if exc is not None:
+                logger.error("Error in %s callback for %s", event, self.name, exc_info=exc)
+                controller.call_soon(lambda: self._emit(controller, self, 'error', group, control, event, exc))
+            else:
+                result = future.result()
+                controller.call_soon(lambda: self._emit(controller, self, 'result', group, control, event, result))
+        finally:
+            self._run_next_job()
+
+
+class _Offloaded:
+    def __init__(self, callback, executor):
+        self.callback = callback
+        self.executor = executor
+
+    def __call__(self, controller, ctrl_instance, event, group, control, *args):
+        ctrl_instance._submit(controller, self.executor, self.callback, (event, group, control) + args)
 
 
 class Momentary(Control):
@@ -186,9 +442,9 @@ class Radio(Control):
     def render(self, controller):
         if self.select_first and not self.first_selected:
             try:
-                self.selected = next(self.controls.all(controller))
+                self.selected = self.controls.all(controller)[0]
                 self.first_selected = True
-            except StopIteration:
+            except IndexError:
                 pass
 
         for group, control in self.controls.all(controller):
@@ -199,14 +455,21 @@ class Radio(Control):
             if self.allow_deselect:
                 prev = self.selected
                 self.selected = None
-                self.render(controller)
+                self._render_change(controller, prev, None)
                 self._emit(controller, self, 'radio', group, control, prev, None)
         else:
             prev = self.selected
             self.selected = (group, control)
-            self.render(controller)
+            self._render_change(controller, prev, self.selected)
             self._emit(controller, self, 'radio', group, control, prev, self.selected)
 
+    def _render_change(self, controller, prev, selected):
+        # Only the previously and newly selected buttons change
+        if prev is not None:
+            controller.set_color(prev[0], prev[1], self.off_color)
+        if selected is not None:
+            controller.set_color(selected[0], selected[1], self.on_color)
+
 
 class Fader(Control):
     def __init__(self, name, controls, **kwargs):
@@ -220,6 +483,30 @@ class Fader(Control):
             self._emit(controller, self, 'max', group, control)
 
 
+def _fader_colors(colors, levels):
+    # colors spread over levels, each color used for an equal run of them
+    per_group = math.ceil(levels / len(colors))
+    return [c for c in colors for _ in range(per_group)]
+
+
+# Painting shared by VirtualFader and FaderBank, fader has colors (see
+# _fader_colors) and group_colors; levels count up from 0
+
+def _fader_pad_color(fader, level, value):
+    # The color of the pad for level when the fader is at value
+    if level > value:
+        return 'off'
+    return fader.colors[level] if fader.group_colors else fader.colors[value]
+
+
+def _fader_changed(fader, old, new, levels):
+    # The levels whose pads change color going from old to new
+    if fader.group_colors or fader.colors[old] == fader.colors[new]:
+        # Only the pads between the old and new level change
+        return range(min(old, new) + 1, max(old, new) + 1)
+    return range(levels)
+
+
 class VirtualFader(Control):
     STORE_BY_ID = True
 
@@ -233,32 +520,33 @@ class VirtualFader(Control):
         self.has_changed = False
         self.on('raw', self._handle_control, O_FIRST)
 
+    def _setup(self, controller):
+        self.control_pos = list(reversed(list(self.controls.all(controller))))
+        self.control_index = {key: idx for idx, key in enumerate(self.control_pos)}
+        if self.colors is None:
+            self.colors = _fader_colors(self.raw_colors, len(self.control_pos))
+
     def render(self, controller):
         if self.control_pos is None:
-            self.control_pos = list(reversed(list(self.controls.all(controller))))
-        if self.colors is None:
-            per_group = math.ceil(len(self.control_pos) / len(self.raw_colors))
-            self.colors = []
-            for c in self.raw_colors:
-                for _ in range(per_group):
-                    self.colors.append(c)
+            self._setup(controller)
 
         for idx, (group, control) in enumerate(self.control_pos):
-            if idx <= self.value:
-                if self.group_colors:
-                    c = self.colors[idx]
-                else:
-                    c = self.colors[self.value]
-                controller.set_color(group, control, c)
-            else:
-                controller.set_color(group, control, 'off')
+            controller.set_color(group, control, _fader_pad_color(self, idx, self.value))
+
+    def _render_change(self, controller, old, new):
+        for idx in _fader_changed(self, old, new, len(self.control_pos)):
+            group, control = self.control_pos[idx]
+            controller.set_color(group, control, _fader_pad_color(self, idx, new))
 
     def _process_value(self, controller, group, control, value):
         if value:
-            new_value = self.control_pos.index((group, control))
+            if self.control_pos is None:
+                self._setup(controller)
+            new_value = self.control_index[(group, control)]
             self.has_changed = (self.value != new_value)
-            self.value = new_value
-            self.render(controller)
+            if self.has_changed:
+                old_value, self.value = self.value, new_value
+                self._render_change(controller, old_value, new_value)
         return int((self.value / 7) * 127)
 
     def _handle_control(self, controller, ctrl_instance, event, group, control, value):
@@ -268,3 +556,165 @@ class VirtualFader(Control):
                 self._emit(controller, self, 'min', group, control)
             elif value == 127:
                 self._emit(controller, self, 'max', group, control)
+
+
+class _Matrix(Control):
+    # One control for a rectangle of grid pads, with per-pad state in flat
+    # arrays indexed by cell (see index()) instead of dicts, and one set of
+    # callbacks for every pad. Callbacks get the same events as for separate
+    # controls, with the pad in group, control.
+    def __init__(self, name, x1, y1, x2, y2, **kwargs):
+        super().__init__(name, GridControlSet(x1, y1, x2, y2), **kwargs)
+        self.x1 = x1
+        self.y1 = y1
+        self.width = x2 - x1 + 1
+        self.height = y2 - y1 + 1
+        # ('GRID', (x, y)) for each cell, row by row
+        self.cells = self.controls.cells()
+        # Last value of each pad, 255 until the first message
+        self.values = bytearray(b'\xff') * len(self.cells)
+
+    def index(self, control):
+        x, y = control
+        return (y - self.y1) * self.width + (x - self.x1)
+
+    def _cell_colors(self, controller):
+        # Compiled color of each cell
+        raise NotImplementedError()
+
+    def render(self, controller):
+        controller.apply_frame(dict(zip(self.cells, self._cell_colors(controller))))
+
+    def _dispatch(self, controller, group, control, value):
+        idx = self.index(control)
+        last_state = self.values[idx]
+        if last_state == 255:
+            last_state = None
+        self.values[idx] = value
+        self._emit(controller, self, 'raw', group, control, value)
+        self._press_events(controller, group, control, last_state, value)
+        self._change_events(controller, group, control, last_state, value)
+
+
+class MomentaryMatrix(_Matrix):
+    def __init__(self, name, x1, y1, x2, y2, on_color='on', off_color='off', **kwargs):
+        super().__init__(name, x1, y1, x2, y2, **kwargs)
+        self.on_color = on_color
+        self.off_color = off_color
+
+    def _cell_colors(self, controller):
+        on = controller._get_color(self.on_color)
+        off = controller._get_color(self.off_color)
+        return [on if v and v != 255 else off for v in self.values]
+
+    def _on_press(self, controller, group, control):
+        controller.set_color(group, control, self.on_color)
+
+    def _on_release(self, controller, group, control):
+        controller.set_color(group, control, self.off_color)
+
+
+class ToggleMatrix(_Matrix):
+    # Like a Toggle on every pad, state[index(control)] is each pad's state
+    def __init__(self, name, x1, y1, x2, y2, states=2, colors=['off', 'on'], **kwargs):
+        if len(colors) != states:
+            raise ValueError("Number of colors must match number of states")
+        super().__init__(name, x1, y1, x2, y2, **kwargs)
+        self.states = states
+        self.colors = colors
+        self.state = bytearray(len(self.cells))
+
+    def _cell_colors(self, controller):
+        colors = [controller._get_color(c) for c in self.colors]
+        return [colors[s] for s in self.state]
+
+    def _on_press(self, controller, group, control):
+        idx = self.index(control)
+        state = self.state[idx] = (self.state[idx] + 1) % self.states
+        controller.set_color(group, control, self.colors[state])
+        self._emit(controller, self, 'toggle', group, control, state)
+
+    def get(self, x, y):
+        return self.state[self.index((x, y))]
+
+    def set(self, controller, x, y, state):
+        # Set a pad's state without emitting 'toggle'. controller may be None
+        # if the matrix isn't showing, it's drawn when its view is next
+        # rendered (e.g. by ViewSet.push or pop).
+        self.set_cells(controller, {self.index((x, y)): state})
+
+    def set_row(self, controller, y, states):
+        start = (y - self.y1) * self.width
+        self.set_cells(controller, {start + i: s for i, s in enumerate(states[:self.width])})
+
+    def fill(self, controller, state=0):
+        self.set_cells(controller, {i: state for i in range(len(self.cells))})
+
+    def set_cells(self, controller, states):
+        # states is {cell index: state}
+        for idx, state in states.items():
+            self.state[idx] = state
+        if controller is not None:
+            colors = [controller._get_color(c) for c in self.colors]
+            controller.apply_frame({self.cells[idx]: colors[state] for idx, state in states.items()})
+
+
+class FaderBank(_Matrix):
+    # A VirtualFader in each column, levels[column] is its level with the
+    # bottom pad (y2) being 0; the column is control[0] - x1. As for
+    # VirtualFader, 'raw' has the column's level scaled to 0-127 and setting
+    # a level emits 'change' (and 'up' or 'down', 'min', 'max') with scaled
+    # values. Unlike VirtualFader, 'press', 'release' and the GESTURES follow
+    # the pads, not the level reaching or leaving 0.
+    def __init__(self, name, x1, y1, x2, y2, colors=None, group_colors=False, **kwargs):
+        super().__init__(name, x1, y1, x2, y2, **kwargs)
+        self.group_colors = group_colors
+        self.colors = _fader_colors(colors or ['on'], self.height)
+        self.levels = bytearray(self.width)
+
+    def _scale(self, level):
+        return int((level / max(1, self.height - 1)) * 127)
+
+    def _cell_colors(self, controller):
+        get_color = controller._get_color
+        out = []
+        for y in range(self.height):
+            level = self.height - 1 - y
+            out.extend(get_color(_fader_pad_color(self, level, v)) for v in self.levels)
+        return out
+
+    def _render_change(self, controller, column, old, new):
+        x = self.x1 + column
+        for level in _fader_changed(self, old, new, self.height):
+            controller.set_color('GRID', (x, self.y1 + self.height - 1 - level), _fader_pad_color(self, level, new))
+
+    def set_level(self, controller, column, level):
+        # Without emitting events; controller may be None as for
+        # ToggleMatrix.set
+        old, self.levels[column] = self.levels[column], level
+        if controller is not None and old != level:
+            self._render_change(controller, column, old, level)
+
+    def _dispatch(self, controller, group, control, value):
+        x, y = control
+        column = x - self.x1
+        old = self.levels[column]
+        if value:
+            self.set_level(controller, column, self.y1 + self.height - 1 - y)
+        new = self.levels[column]
+        self._emit(controller, self, 'raw', group, control, self._scale(new))
+
+        # press and release follow the pad, change etc. the level
+        idx = self.index(control)
+        last_state = self.values[idx]
+        self.values[idx] = value
+        self._press_events(controller, group, control, 0 if last_state == 255 else last_state, value)
+
+        if old == new:
+            return
+        old, new = self._scale(old), self._scale(new)
+        self._change_events(controller, group, control, old, new)
+        if new == 0:
+            self._emit(controller, self, 'min', group, control)
+        elif new == 127:
+            self._emit(controller, self, 'max', group, control)
@@ -1,5 +1,20 @@
+import asyncio
+import contextlib
+import logging
+import queue
+import time
+
 import mido
 
+from ..discovery import discovery
+from ..output import OutputThread
+from ..port import get_raw_sender, set_raw_callback
+from ..record import INPUT, OUTPUT
+from ..timers import TimerWheel
+
+
+logger = logging.getLogger(__name__)
+
 
 class ControllerError(Exception):
     pass
@@ -14,12 +29,14 @@ class MultipleControllersFound(ControllerError):
 
 
 class Color:
-    def __init__(self, rgb=None, name=None, flash=None, fade=None, intensity=None):
+    def __init__(self, rgb=None, name=None, flash=None, fade=None, intensity=None, fast=None):
         self.rgb = rgb
         self.name = name
         self.flash = flash
         self.fade = fade
         self.intensity = intensity
+        # For rgb colors, use the nearest palette color instead
+        self.fast = fast
 
     def __str__(self):
         out = 'Color('
@@ -39,18 +56,183 @@ class ControllerBase:
     HAS_RGB = False
     HAS_GRID = False
 
-    def __init__(self, port_number=None):
-        ports = set(mido.get_input_names())
-        if self.HAS_FEEDBACK:
-            ports &= set(mido.get_output_names())
+    # Groups whose values are continuous, see get_messages(coalesce=...)
+    _CONTINUOUS_GROUPS = ()
+
+    # Max number of distinct color specs kept compiled per controller
+    COLOR_CACHE_SIZE = 256
+    # Max number of (group, control, color) kept encoded as raw messages
+    ENCODED_CACHE_SIZE = 4096
+    # {palette color: (r, g, b)} (0-255), what 'fast' RGB colors are
+    # quantized to, see _quantize
+    _PALETTE = None
+
+    @classmethod
+    def _get_port_names(cls, refresh=False):
+        return discovery.port_names(cls.HAS_FEEDBACK, refresh)
+
+    @classmethod
+    def find_ports(cls, refresh=False):
+        # Names of every port this controller could be opened on. The port
+        # lists are cached, if nothing is found they're enumerated again.
+        ports = list(sorted(filter(lambda p: p.startswith(cls.PORT_NAME), cls._get_port_names(refresh))))
+        if not ports and not refresh:
+            return cls.find_ports(True)
+        return ports
+
+    @classmethod
+    def _open_port(cls, name):
+        return getattr(mido, 'open_ioport' if cls.HAS_FEEDBACK else 'open_input')(name)
+
+    def __init__(self, port_number=None, threaded_output=False, max_rate=None, port=None, port_name=None, reconnect=False):
+        # threaded_output: write LED updates from a background thread, at
+        # most max_rate messages per second if given
+        # port: use an already open port (e.g. a VirtualPort) instead of
+        # looking for the device
+        # port_name: open this port (see find_ports) instead of looking
+        # reconnect: if the device is unplugged, reopen it when it comes back
+        # and restore its LEDs
+        self._queue = queue.Queue()
+        self._listeners = []
+        self._decode_table = self._get_decode_table()
+        # Shadow of what each LED is currently showing, keyed by (group, control)
+        self._leds = {}
+        # Every (group, control) that can be given a color
+        self._led_keys = frozenset(self._all_leds())
+        self._batch_depth = 0
+        self._batch = {}
+        self._colors = {}
+        self._encoded = {}
+        self._captured = None
+        # A record.Recorder, see Recorder.attach
+        self.recorder = None
+        # A stats.Stats, while measuring
+        self.stats = None
+        # Run from the ViewSet loop, see Control's gestures
+        self.timers = TimerWheel()
+
+        if port is None:
+            if port_name is None:
+                f_ports = self.find_ports()
+                if not f_ports:
+                    raise ControllerNotFound(f"No controller named '{self.PORT_NAME}' was found (found {self._get_port_names()})")
+                if len(f_ports) > 1 and port_number is None:
+                    raise MultipleControllersFound(f"Multiple controllers named '{self.PORT_NAME}' were found, the port number is required")
+                port_name = f_ports[port_number or 0]
+
+            port = self._open_port(port_name)
+        self._output = None
+        self._set_port(port)
+        # Identifies the device when there are several, e.g. with a Hub
+        self.name = port_name or getattr(port, 'name', None) or self.PORT_NAME
+        if threaded_output and self.HAS_FEEDBACK:
+            self._output = OutputThread(self._send_raw, max_rate)
+            self._output.start()
+        self.connected = True
+        self._reconnecting = False
+        if reconnect:
+            discovery.watch(self)
+
+    def _set_port(self, port):
+        set_raw_callback(port, self._receive)
+        self.port = port
+        self._send_raw = get_raw_sender(port)
+        if self._output is not None:
+            self._output.send = self._send_raw
+
+    def _disconnect(self):
+        # The device went away. LED updates still go to the shadow, and are
+        # sent when it's reconnected.
+        if not self.connected:
+            return
+        self.connected = False
+        self._send_raw = lambda data: None
+        if self._output is not None:
+            self._output.send = self._send_raw
+        try:
+            self.port.close()
+        except Exception:
+            pass
+
+    def _reconnect(self, name):
+        self._reconnecting = False
+        if self.connected:
+            return
+        try:
+            port = self._open_port(name)
+        except Exception:
+            # Try again next time the ports are checked
+            return
+        self.name = name
+        self._set_port(port)
+        self.connected = True
+        # Whatever the device shows now, put back the LED state in one batch
+        frame = self.snapshot()
+        self._leds.clear()
+        self.apply_frame(frame)
 
-        f_ports = list(sorted(filter(lambda p: p.startswith(self.PORT_NAME), ports)))
-        if not f_ports:
-            raise ControllerNotFound(f"No controller named '{self.PORT_NAME}' was found (found {ports})")
-        if len(f_ports) > 1 and port_number is None:
-            raise MultipleControllersFound(f"Multiple controllers named '{self.PORT_NAME}' were found, the port number is required")
+    def close(self):
+        discovery.unwatch(self)
+        self.connected = False
+        self.port.close()
 
-        self.port = getattr(mido, 'open_ioport' if self.HAS_FEEDBACK else 'open_input')(f_ports[port_number or 0])
+    def _input_message(self, group, control, value):
+        # The message the device would send for this input, for simulating it
+        raise NotImplementedError()
+
+    @classmethod
+    def _build_decode_table(cls):
+        # {status byte: ([(group, control) or None for each data byte 1], value)}
+        # where value is used instead of data byte 2 if not None
+        raise NotImplementedError()
+
+    @classmethod
+    def _get_decode_table(cls):
+        if '_DECODE_TABLE' not in cls.__dict__:
+            cls._DECODE_TABLE = cls._build_decode_table()
+        return cls._DECODE_TABLE
+
+    def _decode(self, data):
+        # Raw message bytes -> (group, control, value), or None if the
+        # message isn't from a control
+        try:
+            keys, value = self._decode_table[data[0]]
+            key = keys[data[1]]
+            if value is None:
+                value = data[2]
+        except (KeyError, IndexError):
+            return None
+        if key is None:
+            return None
+        return key + (value,)
+
+    def _process_control(self, msg):
+        return self._decode(msg.bytes())
+
+    def _receive(self, data):
+        # Called from the rtmidi thread with the raw message bytes
+        t = time.monotonic()
+        self._queue.put((t, data))
+        if self.recorder is not None:
+            # A failing recorder mustn't stop input
+            try:
+                self.recorder.record(INPUT, data, t)
+            except Exception:
+                logger.exception("Error recording input")
+        for listener in self._listeners:
+            listener()
+
+    def wake(self):
+        self._queue.put(None)
+        for listener in self._listeners:
+            listener()
+
+    def call_soon(self, callback):
+        # Run callback from the thread reading messages (get_messages), safe
+        # to call from any thread
+        self._queue.put(callback)
+        for listener in self._listeners:
+            listener()
 
     def _interpret_color(self, color):
         out = None
@@ -85,6 +267,7 @@ class ControllerBase:
             flags = {
                 'flash': ('flash' in flags),
                 'fade': ('fade' in flags),
+                'fast': ('fast' in flags),
             }
 
             if out:
@@ -95,35 +278,255 @@ class ControllerBase:
         return out
 
 
-    def get_messages(self):
-        for msg in self.port.iter_pending():
-            res = self._process_control(msg)
+    def _read_messages(self, timeout):
+        block = timeout != 0
+        while True:
+            try:
+                item = self._queue.get(block, timeout)
+            except queue.Empty:
+                return
+            block = False
+            if item is None:
+                continue
+            if callable(item):
+                item()
+                continue
+            stats = self.stats
+            if stats is None:
+                res = self._decode(item[1])
+            else:
+                t = time.perf_counter()
+                stats._input(item[0], time.monotonic(), self._queue.qsize() + 1)
+                res = self._decode(item[1])
+                stats.stages['decode'].add(time.perf_counter() - t)
             if res:
                 yield res
 
+    def _coalesce(self, messages):
+        latest = {}
+        for i, (group, control, _) in enumerate(messages):
+            if group in self._CONTINUOUS_GROUPS:
+                latest[(group, control)] = i
+        for i, res in enumerate(messages):
+            if res[0] in self._CONTINUOUS_GROUPS and latest[res[:2]] != i:
+                continue
+            yield res
+
+    def get_messages(self, timeout=0, coalesce=False):
+        # timeout=0 returns only what is pending, None blocks until a message
+        # arrives (or wake() is called), otherwise wait up to timeout seconds.
+        # With coalesce, only the last value of each continuous control
+        # (faders etc.) in the pending messages is returned; if coalesce is a
+        # number, keep collecting for that many seconds after the first one.
+        if not coalesce:
+            yield from self._read_messages(timeout)
+            return
+
+        messages = list(self._read_messages(timeout))
+        if messages and coalesce is not True:
+            deadline = time.monotonic() + coalesce
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                messages.extend(self._read_messages(remaining))
+        yield from self._coalesce(messages)
+
+    async def aiter_messages(self, coalesce=False):
+        loop = asyncio.get_running_loop()
+        event = asyncio.Event()
+
+        def notify():
+            loop.call_soon_threadsafe(event.set)
+
+        self._listeners.append(notify)
+        try:
+            while True:
+                event.clear()
+                for res in self.get_messages(coalesce=bool(coalesce)):
+                    yield res
+                await event.wait()
+                if coalesce and coalesce is not True:
+                    await asyncio.sleep(coalesce)
+        finally:
+            self._listeners.remove(notify)
+
     def send(self, type_, **kwargs):
-        return self.port.send(mido.Message(type_, **kwargs))
+        self._write(tuple(mido.Message(type_, **kwargs).bytes()))
 
-    def reset(self, *groups):
-        btns = []
-        if groups:
-            for g, c in self._BTN_MAP.values():
-                if g in groups:
-                    btns.append((g, c))
-            if 'GRID' in groups and self.HAS_GRID:
-                w, h = self._GRID_SIZE
-                for y in range(h):
-                    for x in range(w):
-                        btns.append(('GRID', (x, y)))
+    def _write(self, data):
+        if self._captured is not None:
+            self._captured.append(data)
+        else:
+            self._send_messages((data,))
+
+    def _send_messages(self, messages, key=None):
+        # messages are raw bytes, key is what they update (see OutputThread.put)
+        if self.recorder is not None:
+            try:
+                for data in messages:
+                    self.recorder.record(OUTPUT, data)
+            except Exception:
+                logger.exception("Error recording output")
+        stats = self.stats
+        if stats is not None:
+            t = time.perf_counter()
+        if self._output is not None:
+            self._output.put(key, messages)
+        else:
+            for data in messages:
+                self._send_raw(data)
+        if stats is not None:
+            stats._send(len(messages), time.perf_counter() - t)
+
+    @property
+    def output_pending(self):
+        # Number of updates waiting for the output thread
+        return len(self._output) if self._output is not None else 0
+
+    def flush_output(self, timeout=None):
+        # Wait for the output thread to write everything queued so far
+        if self._output is not None:
+            return self._output.join_pending(timeout)
+        return True
+
+    def _compile_color(self, color):
+        # Turn a color spec into whatever _set_color needs to send it, this
+        # is only called once per distinct spec
+        return self._interpret_color(color)
+
+    @classmethod
+    def _palette_lut(cls):
+        # Nearest palette color for RGB colors with 4 bits per channel, built
+        # on first use
+        if '_PALETTE_LUT' not in cls.__dict__:
+            names = list(cls._PALETTE)
+            palette = list(cls._PALETTE.values())
+            lut = []
+            for i in range(4096):
+                r, g, b = (i >> 8) * 17, ((i >> 4) & 15) * 17, (i & 15) * 17
+                lut.append(names[min(
+                    range(len(palette)),
+                    key=lambda j: (palette[j][0] - r) ** 2 + (palette[j][1] - g) ** 2 + (palette[j][2] - b) ** 2,
+                )])
+            cls._PALETTE_LUT = tuple(lut)
+        return cls._PALETTE_LUT
+
+    def _quantize(self, rgb):
+        # The nearest palette color to an interpreted (0-127) rgb
+        r, g, b = rgb
+        return self._palette_lut()[((r >> 3) << 8) | ((g >> 3) << 4) | (b >> 3)]
+
+    def _get_color(self, color):
+        try:
+            return self._colors[color]
+        except KeyError:
+            pass
+        compiled = self._compile_color(color)
+        if len(self._colors) >= self.COLOR_CACHE_SIZE:
+            del self._colors[next(iter(self._colors))]
+        self._colors[color] = compiled
+        return compiled
+
+    def _set_color(self, group, control, color):
+        # color is the result of _compile_color. Only called once for each
+        # (group, control, color), the messages it sends are kept by _encode.
+        raise NotImplementedError()
+
+    def _encode(self, group, control, color):
+        # The raw messages that set (group, control) to a compiled color
+        key = (group, control, color)
+        try:
+            return self._encoded[key]
+        except KeyError:
+            pass
+        self._captured = []
+        try:
+            self._set_color(group, control, color)
+            messages = tuple(self._captured)
+        finally:
+            self._captured = None
+        if len(self._encoded) >= self.ENCODED_CACHE_SIZE:
+            del self._encoded[next(iter(self._encoded))]
+        self._encoded[key] = messages
+        return messages
+
+    def set_color(self, group, control, color):
+        self._set_compiled(group, control, self._get_color(color))
+
+    def _set_compiled(self, group, control, color):
+        key = (group, control)
+        if self._leds.get(key) == color:
+            if self.stats is not None:
+                self.stats.redundant += 1
+            return
+        if key not in self._led_keys:
+            # Before it's in the shadow, batched or not
+            raise ValueError(f"{group} {control} has no LED")
+        if self._batch_depth:
+            self._batch[key] = color
         else:
-            btns = list(self._BTN_MAP.values())
-            if self.HAS_GRID:
-                w, h = self._GRID_SIZE
+            # Keyed by LED so with an output thread, a newer color replaces
+            # this one if it hasn't been written yet
+            self._send_messages(self._encode(group, control, color), key)
+        self._leds[key] = color
+
+    @contextlib.contextmanager
+    def batch(self):
+        # Collect set_color calls and send them together when the outermost
+        # batch exits, for devices that can update many LEDs in one message
+        self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+            if not self._batch_depth and self._batch:
+                pending, self._batch = self._batch, {}
+                try:
+                    self._flush(pending)
+                except Exception:
+                    # Some may not have been sent, forget them so they are
+                    # the next time they're set
+                    for key in pending:
+                        self._leds.pop(key, None)
+                    raise
+
+    def _flush(self, pending):
+        for (group, control), color in pending.items():
+            self._send_messages(self._encode(group, control, color), (group, control))
+
+    def invalidate(self):
+        # Forget the LED state, the next set_color for each LED is always sent
+        self._leds.clear()
+
+    @classmethod
+    def _all_leds(cls):
+        # Every (group, control) with an LED
+        if '_ALL_LEDS' not in cls.__dict__:
+            leds = list(cls._BTN_MAP.values())
+            if cls.HAS_GRID:
+                w, h = cls._GRID_SIZE
                 for y in range(h):
                     for x in range(w):
-                        btns.append(('GRID', (x, y)))
-        for g, c in btns:
-            try:
-                self.set_color(g, c, 'off')
-            except:
-                pass
+                        leds.append(('GRID', (x, y)))
+            cls._ALL_LEDS = tuple(leds)
+        return cls._ALL_LEDS
+
+    def snapshot(self):
+        # The current LED state, for apply_frame
+        return dict(self._leds)
+
+    def apply_frame(self, frame):
+        # Set LEDs from a snapshot(), sending only the ones that differ.
+        # LEDs not in the frame are left alone.
+        with self.batch():
+            for (group, control), color in frame.items():
+                self._set_compiled(group, control, color)
+
+    def reset(self, *groups):
+        off = self._get_color('off')
+        self.apply_frame({
+            (g, c): off
+            for g, c in self._all_leds()
+            if not groups or g in groups
+        })
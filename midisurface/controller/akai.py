@@ -1,3 +1,5 @@
+import mido
+
 from . import ControllerBase
 
 
@@ -30,6 +32,7 @@ class APCMini(ControllerBase):
     }
     _BTN_MAP_INV = dict(map(reversed, _BTN_MAP.items()))
     _GRID_SIZE = (8, 8)
+    _CONTINUOUS_GROUPS = ('FADER',)
 
     _COL_MAP = {
         ('off', False): 0,
@@ -44,35 +47,64 @@ class APCMini(ControllerBase):
         ('yellow', True): 6,
     }
 
-    def _process_control(self, msg):
-        if msg.type in ('note_on', 'note_off'):
-            value = (True if msg.type == 'note_on' else False)
-            if msg.note < 64:
-                y, x = divmod(msg.note, 8)
-                y = 7 - y
-                return 'GRID', (x, y), value
+    # For 'fast' RGB colors
+    _PALETTE = {
+        'off': (0, 0, 0),
+        'green': (0, 255, 0),
+        'red': (255, 0, 0),
+        'yellow': (255, 255, 0),
+    }
+
+    @classmethod
+    def _build_decode_table(cls):
+        notes = [None] * 128
+        for note in range(128):
+            if note < 64:
+                y, x = divmod(note, 8)
+                notes[note] = ('GRID', (x, 7 - y))
             else:
-                return tuple(list(self._BTN_MAP[msg.note]) + [value])
-        elif msg.type == 'control_change':
-            return 'FADER', msg.control - 48, msg.value
+                notes[note] = cls._BTN_MAP.get(note)
+        ccs = [('FADER', cc - 48) for cc in range(128)]
+
+        table = {}
+        for channel in range(16):
+            table[0x90 | channel] = (notes, True)
+            table[0x80 | channel] = (notes, False)
+            table[0xb0 | channel] = (ccs, None)
+        return table
+
+    def _input_message(self, group, control, value):
+        if group == 'FADER':
+            return mido.Message('control_change', control=control + 48, value=value)
+        if group == 'GRID':
+            note = ((7 - control[1]) * 8) + control[0]
+        else:
+            note = self._BTN_MAP_INV[(group, control)]
+        return mido.Message('note_on' if value else 'note_off', note=note, velocity=127 if value else 0)
 
     def _interpret_color(self, color):
         color = super()._interpret_color(color)
         if color.rgb:
-            raise ValueError("No RGB support")
+            if not color.fast:
+                raise ValueError("No RGB support, use a 'fast' RGB color for the nearest of off/green/red/yellow")
+            color.name = self._quantize(color.rgb)
         if color.fade:
             raise ValueError("No fade support")
         if (color.name, bool(color.flash)) not in self._COL_MAP:
             raise ValueError("Invalid color: " + str(color))
         return color
 
-    def set_color(self, group, control, color):
+    def _compile_color(self, color):
         color = self._interpret_color(color)
+        # (grid velocity, button velocity)
+        return self._COL_MAP[(color.name, bool(color.flash))], 0 if color.name == 'off' else 1
+
+    def _set_color(self, group, control, color):
         if group == 'SHIFT':
             return
         elif group == 'GRID':
-            self.send('note_on', note=((7 - control[1]) * 8) + control[0], velocity=self._COL_MAP[(color.name, bool(color.flash))])
+            self.send('note_on', note=((7 - control[1]) * 8) + control[0], velocity=color[0])
         elif group in ('RIGHT', 'NAV', 'FADER_CTRL'):
-            self.send('note_on', note=self._BTN_MAP_INV[(group, control)], velocity=0 if color.name == 'off' else 1)
+            self.send('note_on', note=self._BTN_MAP_INV[(group, control)], velocity=color[1])
         else:
-            raise ValueError("Invalid group")
\ No newline at end of file
+            raise ValueError("Invalid group")
@@ -1,3 +1,7 @@
+import itertools
+
+import mido
+
 from . import ControllerBase
 
 
@@ -29,6 +33,13 @@ class LaunchpadMK2(ControllerBase):
     }
     _BTN_MAP_INV = dict(map(reversed, _BTN_MAP.items()))
 
+    # (group, control) -> LED number used in sysex messages
+    _LED_INDEX = dict(_BTN_MAP_INV)
+    for _y in range(8):
+        for _x in range(8):
+            _LED_INDEX[('GRID', (_x, _y))] = 11 + ((7 - _y) * 10) + _x
+    del _x, _y
+
     _GRID_SIZE = (8, 8)
 
     _COL_MAP = {
@@ -51,17 +62,65 @@ class LaunchpadMK2(ControllerBase):
         'pink': (56, 4, True),
     }
 
-    def _process_control(self, msg):
-        if msg.type == 'control_change':
-            group, control = self._BTN_MAP[msg.control]
-            return group, control, msg.value
-        else:
-            if msg.note in self._BTN_MAP:
-                group, control = self._BTN_MAP[msg.note]
-                return group, control, msg.velocity
-            x = int((msg.note - 11) % 10)
-            y = 7 - int((msg.note - 11) / 10)
-            return 'GRID', (x, y), msg.velocity
+    # Palette indexes for each color, from brightest to dimmest
+    _COL_INDEXES = {}
+    for _name, (_offset, _count, _invert) in _COL_MAP.items():
+        _intensities = list(range(_offset, _offset + _count))
+        if _invert:
+            _intensities.reverse()
+        _intensities[0], _intensities[-1] = _intensities[-1], _intensities[0]
+        _COL_INDEXES[_name] = _intensities
+    del _name, _offset, _count, _invert, _intensities
+
+    # Approximate RGB of the palette entries the named colors use, each
+    # color's block is light, full, dim and very dim. The rest of the 128
+    # color palette isn't used.
+    _PALETTE = {0: (0, 0, 0), 1: (28, 28, 28), 2: (124, 124, 124), 3: (252, 252, 252)}
+    for _offset, _rgb in (
+            (4, (255, 0, 0)), (8, (255, 85, 0)), (12, (255, 255, 0)), (16, (128, 255, 0)),
+            (20, (0, 255, 0)), (24, (0, 255, 64)), (28, (0, 255, 128)), (32, (0, 255, 200)),
+            (36, (0, 170, 255)), (40, (0, 85, 255)), (44, (0, 0, 255)), (48, (128, 0, 255)),
+            (52, (255, 0, 255)), (56, (255, 0, 85))):
+        _PALETTE[_offset] = tuple(int(v + ((255 - v) * 0.3)) for v in _rgb)
+        _PALETTE[_offset + 1] = _rgb
+        _PALETTE[_offset + 2] = tuple(int(v * 0.35) for v in _rgb)
+        _PALETTE[_offset + 3] = tuple(int(v * 0.1) for v in _rgb)
+    del _offset, _rgb
+
+    @classmethod
+    def _build_decode_table(cls):
+        notes = [None] * 128
+        for note in range(128):
+            if note in cls._BTN_MAP:
+                notes[note] = cls._BTN_MAP[note]
+            else:
+                x = (note - 11) % 10
+                y = 7 - ((note - 11) // 10)
+                if 0 <= x < 8 and 0 <= y < 8:
+                    notes[note] = ('GRID', (x, y))
+        ccs = [cls._BTN_MAP.get(cc) for cc in range(128)]
+
+        table = {}
+        for channel in range(16):
+            table[0x90 | channel] = (notes, None)
+            table[0x80 | channel] = (notes, 0)
+            table[0xb0 | channel] = (ccs, None)
+        return table
+
+    def _input_message(self, group, control, value):
+        if group == 'NAV' or group == 'MODE':
+            return mido.Message('control_change', control=self._BTN_MAP_INV[(group, control)], value=value)
+        return mido.Message('note_on', note=self._led_index(group, control), velocity=value)
+
+    # Maximum number of LEDs in one SysEx message
+    _SYSEX_MAX_LEDS = 80
+
+    def _led_index(self, x, y):
+        return self._LED_INDEX[(x, y)]
+
+    def _send_sysex(self, command, *data):
+        # Written as raw bytes, mido's validation of long sysex messages is slow
+        self._write((0xf0, 0, 32, 41, 2, 24, command) + data + (0xf7,))
 
     def _send_color_basic(self, x, y, channel, index):
         if x == 'GRID':
@@ -77,38 +136,16 @@ class LaunchpadMK2(ControllerBase):
 
     def _get_color_index(self, color, intensity=None):
         intensity = 4 if intensity is None else intensity
-        offset, count, invert = self._COL_MAP[color]
-        intensities = list(map(int, range(offset, offset + count)))
-        if invert:
-            intensities = list(reversed(intensities))
-        intensities[0], intensities[-1] = intensities[-1], intensities[0]
+        intensities = self._COL_INDEXES[color]
         return intensities[min(len(intensities) - 1, intensity - 1)]
 
     def _set_color_basic(self, x, y, color):
-        index = self._get_color_index(color.name, color.intensity)
-        flash_index = None
-        if color.flash and color.flash is not True:
-            flash_index = self._get_color_index(color.flash.name, color.flash.intensity)
-
-        if color.flash:
-            if flash_index is not None:
-                self._send_color_basic(x, y, 0, index)
-                self._send_color_basic(x, y, 1, flash_index)
-            else:
-                self._send_color_basic(x, y, 1, index)
-        elif color.fade:
-            self._send_color_basic(x, y, 2, index)
-        else:
-            self._send_color_basic(x, y, 0, index)
+        for channel, index in color:
+            self._send_color_basic(x, y, channel, index)
 
     def _set_color_rgb(self, x, y, color):
-        r, g, b = color.rgb
-        if x == 'GRID':
-            x, y = y
-            button = int(11 + (((7 - y) * 10) + x))
-        else:
-            button = self._BTN_MAP_INV[(x, y)]
-        self.send('sysex', data=[0, 32, 41,  2, 24, 11, button, r, g, b])
+        r, g, b = color
+        self._send_sysex(11, self._led_index(x, y), r, g, b)
 
     def _interpret_color(self, color):
         color = super()._interpret_color(color)
@@ -123,9 +160,46 @@ class LaunchpadMK2(ControllerBase):
                 raise ValueError("Invalid flash color: " + str(color.flash))
         return color
 
-    def set_color(self, group, control, color):
+    def _compile_color(self, color):
+        # (rgb, ((channel, index), ...))
         color = self._interpret_color(color)
+        if color.rgb and color.fast:
+            # A palette color is 3 bytes rather than a 10 byte sysex
+            return None, ((0, self._quantize(color.rgb)),)
         if color.rgb:
-            self._set_color_rgb(group, control, color)
+            return tuple(color.rgb), ()
+
+        index = self._get_color_index(color.name, color.intensity)
+        if color.flash:
+            if color.flash is not True:
+                return None, ((0, index), (1, self._get_color_index(color.flash.name, color.flash.intensity)))
+            return None, ((1, index),)
+        elif color.fade:
+            return None, ((2, index),)
+        return None, ((0, index),)
+
+    def _set_color(self, group, control, color):
+        if color[0]:
+            self._set_color_rgb(group, control, color[0])
+        else:
+            self._set_color_basic(group, control, color[1])
+
+    def _flush(self, pending):
+        static = []
+        rgb = []
+        for (group, control), (color_rgb, color_basic) in pending.items():
+            if color_rgb:
+                rgb.append((self._led_index(group, control),) + color_rgb)
+            elif color_basic[0][0] == 0 and len(color_basic) == 1:
+                static.append((self._led_index(group, control), color_basic[0][1]))
+            else:
+                self._set_color_basic(group, control, color_basic)
+
+        if len(static) == len(self._all_leds()) and len(set(i for _, i in static)) == 1:
+            # Every LED is the same color
+            self._send_sysex(14, static[0][1])
         else:
-            self._set_color_basic(group, control, color)
\ No newline at end of file
+            for i in range(0, len(static), self._SYSEX_MAX_LEDS):
+                self._send_sysex(10, *itertools.chain.from_iterable(static[i:i + self._SYSEX_MAX_LEDS]))
+        for i in range(0, len(rgb), self._SYSEX_MAX_LEDS):
+            self._send_sysex(11, *itertools.chain.from_iterable(rgb[i:i + self._SYSEX_MAX_LEDS]))
@@ -0,0 +1,92 @@
+import threading
+import time
+import weakref
+
+import mido
+
+
+class Discovery:
+    # Caches the MIDI backend's port lists, so opening several controllers
+    # only enumerates ports once, and watches for devices being unplugged and
+    # plugged back in (by polling every interval seconds) to reconnect
+    # controllers opened with reconnect=True.
+
+    def __init__(self, interval=0.25):
+        self.interval = interval
+        self.inputs = None
+        self.outputs = None
+        self.lock = threading.Lock()
+        self.watched = weakref.WeakSet()
+        self.thread = None
+
+    def refresh(self):
+        # Enumerate the ports again, returns the (added, removed) port names
+        inputs = set(mido.get_input_names())
+        outputs = set(mido.get_output_names())
+        with self.lock:
+            before = (self.inputs or set()) | (self.outputs or set())
+            self.inputs = inputs
+            self.outputs = outputs
+        now = inputs | outputs
+        return now - before, before - now
+
+    def port_names(self, outputs=False, refresh=False):
+        # Names of the input ports, that are also output ports if outputs
+        if refresh or self.inputs is None:
+            self.refresh()
+        with self.lock:
+            return (self.inputs & self.outputs) if outputs else set(self.inputs)
+
+    def watch(self, controller):
+        self.watched.add(controller)
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+
+    def unwatch(self, controller):
+        self.watched.discard(controller)
+
+    def _run(self):
+        # Ports are diffed against what this loop saw last, not the cache,
+        # which anything can refresh in between
+        seen = None
+        while True:
+            time.sleep(self.interval)
+            if not self.watched:
+                continue
+            try:
+                self.refresh()
+            except Exception:
+                continue
+            with self.lock:
+                inputs, outputs = self.inputs, self.outputs
+            now = inputs | outputs
+            if seen is not None:
+                self._check(inputs, outputs, now - seen, seen - now)
+            seen = now
+
+    def _check(self, inputs, outputs, added, removed):
+        controllers = list(self.watched)
+        in_use = set(c.name for c in controllers if c.connected)
+        for controller in controllers:
+            if controller.connected:
+                if controller.name in removed:
+                    controller.call_soon(controller._disconnect)
+                continue
+            if controller._reconnecting:
+                continue
+            # From the lists just enumerated, find_ports() could refresh them
+            names = sorted(n for n in ((inputs & outputs) if controller.HAS_FEEDBACK else inputs) if n.startswith(controller.PORT_NAME))
+            if controller.name in names:
+                name = controller.name
+            else:
+                # The same device may come back under a new name (e.g. a
+                # different ALSA client number), take a new port of this type
+                name = next((n for n in names if n in added and n not in in_use), None)
+            if name is not None:
+                in_use.add(name)
+                controller._reconnecting = True
+                controller.call_soon(lambda controller=controller, name=name: controller._reconnect(name))
+
+# Shared by all controllers
+discovery = Discovery()
@@ -0,0 +1,116 @@
+import asyncio
+import queue
+import time
+
+from .view import ViewSet
+
+
+class Hub:
+    # Runs the ViewSets of several controllers from one loop. Each controller
+    # tells the hub when it has input, so the hub only sleeps on one queue
+    # and only looks at controllers that have something to dispatch.
+    #   hub = Hub()
+    #   hub.register(LaunchpadMK2, setup)  # setup(viewset) for each MK2 found
+    #   hub.register(APCMini, setup_apc)
+    #   hub.run()
+
+    def __init__(self):
+        # controller -> ViewSet; by controller rather than name, as
+        # reconnecting can rename it
+        self.surfaces = {}
+        # controller -> the listener add() gave it
+        self._listeners = {}
+        self._ready = queue.SimpleQueue()
+        self._async_notify = None
+
+    def register(self, controller_cls, setup=None, **kwargs):
+        # Open every port controller_cls can be used on, kwargs are passed to
+        # the controller. Returns the new ViewSets.
+        out = []
+        names = {controller.name for controller in self.surfaces}
+        for name in controller_cls.find_ports():
+            if name not in names:
+                out.append(self.add(controller_cls(port_name=name, **kwargs), setup))
+        return out
+
+    def add(self, controller, setup=None):
+        viewset = ViewSet(controller)
+        self.surfaces[controller] = viewset
+        listener = self._listeners[controller] = lambda: self._notify(viewset)
+        controller._listeners.append(listener)
+        if setup:
+            setup(viewset)
+        return viewset
+
+    def remove(self, controller):
+        listener = self._listeners.pop(controller, None)
+        if listener is not None:
+            controller._listeners.remove(listener)
+        return self.surfaces.pop(controller, None)
+
+    def _notify(self, viewset):
+        # Called from the controller's input thread
+        self._ready.put(viewset)
+        if self._async_notify is not None:
+            self._async_notify()
+
+    def _next_deadline(self):
+        deadline = None
+        for viewset in self.surfaces.values():
+            t = viewset._next_deadline()
+            if t is not None and (deadline is None or t < deadline):
+                deadline = t
+        return deadline
+
+    def _wait_time(self, timeout):
+        deadline = self._next_deadline()
+        if deadline is None:
+            return timeout
+        until = max(0, deadline - time.monotonic())
+        return until if timeout is None else min(timeout, until)
+
+    def _run_tickers(self):
+        for viewset in list(self.surfaces.values()):
+            viewset._run_tickers()
+
+    def _dispatch_ready(self, block, timeout, coalesce):
+        # One dispatch per notification; after the first, a notification for
+        # the same surface usually finds its queue empty, which is cheap, but
+        # it may be for input that arrived since, which mustn't be skipped
+        while True:
+            try:
+                viewset = self._ready.get(block, timeout)
+            except queue.Empty:
+                return
+            block = False
+            viewset.dispatch(0, coalesce)
+
+    def dispatch(self, timeout=0, coalesce=False):
+        self._dispatch_ready(timeout != 0, timeout, coalesce)
+
+    def run(self, timeout=None, on_tick=None, coalesce=False):
+        while True:
+            self.dispatch(self._wait_time(timeout), coalesce)
+            self._run_tickers()
+            if on_tick:
+                on_tick(self)
+
+    async def run_async(self, coalesce=False):
+        loop = asyncio.get_running_loop()
+        event = asyncio.Event()
+        self._async_notify = lambda: loop.call_soon_threadsafe(event.set)
+        try:
+            while True:
+                event.clear()
+                # A coalesce time is slept for here, not in dispatch, so the
+                # event loop isn't blocked
+                self.dispatch(0, bool(coalesce))
+                self._run_tickers()
+                try:
+                    await asyncio.wait_for(event.wait(), self._wait_time(None))
+                except asyncio.TimeoutError:
+                    pass
+                if event.is_set() and coalesce and coalesce is not True:
+                    await asyncio.sleep(coalesce)
+        finally:
+            self._async_notify = None
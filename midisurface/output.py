@@ -0,0 +1,64 @@
+import collections
+import itertools
+import logging
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+class OutputThread(threading.Thread):
+    # Writes messages in the background. Messages are queued under a key,
+    # queueing under a key that is already pending replaces what was there,
+    # so only the latest update for each LED is sent.
+
+    def __init__(self, send, max_rate=None):
+        # send is called with each message
+        super().__init__(daemon=True)
+        self.send = send
+        self.interval = (1 / max_rate) if max_rate else 0
+        self.pending = collections.OrderedDict()
+        self.cond = threading.Condition()
+        self.seq = itertools.count()
+        self.busy = False
+
+    def __len__(self):
+        return len(self.pending)
+
+    def put(self, key, messages):
+        with self.cond:
+            if key is None:
+                key = next(self.seq)
+            elif key in self.pending:
+                # Keep it after anything queued since, e.g. a batch that
+                # included this LED
+                self.pending.move_to_end(key)
+            self.pending[key] = messages
+            self.cond.notify_all()
+
+    def join_pending(self, timeout=None):
+        # Wait until everything queued so far has been written
+        with self.cond:
+            return self.cond.wait_for(lambda: not self.pending and not self.busy, timeout)
+
+    def run(self):
+        next_send = 0
+        while True:
+            with self.cond:
+                self.busy = False
+                self.cond.notify_all()
+                self.cond.wait_for(lambda: self.pending)
+                _, messages = self.pending.popitem(last=False)
+                self.busy = True
+            for msg in messages:
+                if self.interval:
+                    now = time.monotonic()
+                    if next_send > now:
+                        time.sleep(next_send - now)
+                        now = next_send
+                    next_send = now + self.interval
+                try:
+                    self.send(msg)
+                except Exception:
+                    logger.exception("Error sending message")
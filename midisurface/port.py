@@ -0,0 +1,81 @@
+import mido
+
+
+def set_raw_callback(port, callback):
+    # Have port call callback(data) with the bytes of each incoming message,
+    # without parsing them into mido.Messages where the port allows it
+    if hasattr(port, 'raw_callback'):
+        port.raw_callback = callback
+        return
+    rt = getattr(getattr(port, 'input', port), '_rt', None)
+    if rt is not None and hasattr(rt, 'set_callback'):
+        # mido's rtmidi backend, take over the rtmidi.MidiIn callback
+        rt.cancel_callback()
+        rt.set_callback(lambda event, data: callback(event[0]))
+        return
+    port.callback = lambda msg: callback(msg.bytes())
+
+
+def get_raw_sender(port):
+    # A function that writes the raw bytes of a message to port, directly to
+    # rtmidi where possible so mido doesn't have to build a Message
+    if hasattr(port, 'send_raw'):
+        return port.send_raw
+    rt = getattr(getattr(port, 'output', port), '_rt', None)
+    if rt is not None and hasattr(rt, 'send_message'):
+        return rt.send_message
+    return lambda data: port.send(mido.Message.from_bytes(data))
+
+
+class VirtualPort:
+    # In-process stand-in for a device port, pass it to a controller with
+    # port=VirtualPort(). Messages given to feed() are delivered as if the
+    # device sent them, the raw bytes of everything the controller sends are
+    # kept in sent.
+
+    def __init__(self, name='Virtual', callback=None):
+        self.name = name
+        self.callback = callback
+        # If set, called with the bytes of each message instead of callback
+        self.raw_callback = None
+        self.sent = []
+        self.closed = False
+
+    def feed(self, *messages):
+        for msg in messages:
+            if isinstance(msg, dict):
+                msg = mido.Message(**msg)
+            if self.raw_callback is not None:
+                self.raw_callback(msg.bytes())
+            else:
+                self.callback(msg)
+
+    def feed_raw(self, *messages):
+        for data in messages:
+            if self.raw_callback is not None:
+                self.raw_callback(data)
+            else:
+                self.callback(mido.Message.from_bytes(data))
+
+    def press(self, controller, group, control, value=127):
+        self.feed(controller._input_message(group, control, value))
+
+    def release(self, controller, group, control):
+        self.feed(controller._input_message(group, control, 0))
+
+    @property
+    def messages(self):
+        # sent, as mido.Messages
+        return [mido.Message.from_bytes(data) for data in self.sent]
+
+    def send(self, msg):
+        self.sent.append(tuple(msg.bytes()))
+
+    def send_raw(self, data):
+        self.sent.append(tuple(data))
+
+    def clear(self):
+        self.sent = []
+
+    def close(self):
+        self.closed = True
@@ -0,0 +1,260 @@
+import multiprocessing
+import queue
+import struct
+import threading
+import time
+from multiprocessing import shared_memory
+
+from .controller import ControllerBase
+from .port import set_raw_callback
+from .timers import TimerWheel
+
+
+# Run a controller's MIDI I/O in its own process, so it keeps up while the
+# application's process is busy:
+#   controller = spawn(LaunchpadMK2)
+#   viewset = ViewSet(controller)
+# The I/O process decodes input and writes (group, control, value) events to
+# a shared memory ring, the application writes LED colors to a shared memory
+# framebuffer that the I/O process diffs against what it last sent.
+
+RING_SIZE = 4096
+# Ring header: write count, read count
+_RING_HEADER = 16
+# time.monotonic() of arrival, input index (see _input_keys), value
+_EVENT = struct.Struct('<dHB')
+_EVENT_SIZE = 16
+# Color ids in the framebuffer are 16 bit, 0 is never set
+_MAX_COLORS = 0xffff
+
+
+def _input_keys(controller_cls):
+    # Every (group, control) the controller can send, events refer to them by
+    # index into this
+    keys = []
+    for entry_keys, _ in controller_cls._get_decode_table().values():
+        for key in entry_keys:
+            if key is not None and key not in keys:
+                keys.append(key)
+    return keys
+
+
+def _io_main(controller_cls, args, kwargs, ring_shm, fb_shm, events, leds):
+    # Runs in the I/O process. events is written to after adding to the ring,
+    # leds receives ('color', id, spec), ('flush',), ('invalidate',),
+    # ('reset_colors',) and ('close',).
+    controller = controller_cls(*args, **kwargs)
+    index = {key: i for i, key in enumerate(_input_keys(controller_cls))}
+    leds_all = controller._all_leds()
+    header = ring_shm.buf[:_RING_HEADER].cast('Q')
+    ring = ring_shm.buf
+    fb = fb_shm.buf[:len(leds_all) * 2].cast('H')
+    last = [0] * len(fb)
+    specs = {}
+    lock = threading.Lock()
+
+    def receive(data):
+        res = controller._decode(data)
+        if res is None:
+            return
+        with lock:
+            written = header[0]
+            if written - header[1] >= RING_SIZE:
+                # The application isn't keeping up, drop it
+                return
+            _EVENT.pack_into(ring, _RING_HEADER + (written % RING_SIZE) * _EVENT_SIZE, time.monotonic(), index[res[:2]], res[2])
+            header[0] = written + 1
+            events.send_bytes(b'\0')
+
+    set_raw_callback(controller.port, receive)
+
+    try:
+        while True:
+            messages = [leds.recv()]
+            while leds.poll():
+                messages.append(leds.recv())
+            flush = False
+            for msg in messages:
+                if msg[0] == 'color':
+                    specs[msg[1]] = msg[2]
+                elif msg[0] == 'flush':
+                    flush = True
+                elif msg[0] == 'invalidate':
+                    controller.invalidate()
+                    last = [0] * len(fb)
+                elif msg[0] == 'reset_colors':
+                    specs.clear()
+                    last = [0] * len(fb)
+                elif msg[0] == 'close':
+                    return
+            if not flush:
+                continue
+            with controller.batch():
+                for i, color in enumerate(fb):
+                    if color != last[i]:
+                        if color:
+                            try:
+                                spec = specs[color]
+                            except KeyError:
+                                # Written since the messages were read, its
+                                # ('color', ...) and a flush are still to come
+                                continue
+                            group, control = leds_all[i]
+                            controller.set_color(group, control, spec)
+                        last[i] = color
+    finally:
+        controller.flush_output()
+        fb.release()
+        header.release()
+
+
+class ProcessController(ControllerBase):
+    # The application side of spawn(), used in place of the controller.
+    # set_color takes the same colors, they are only interpreted in the I/O
+    # process.
+
+    def __init__(self, controller_cls, *args, **kwargs):
+        self.controller_cls = controller_cls
+        self._queue = queue.Queue()
+        self._listeners = []
+        self._leds = {}
+        self._batch_depth = 0
+        self._batch = {}
+        # color spec -> id in the framebuffer
+        self._color_ids = {}
+        self.recorder = None
+        self.stats = None
+        self.timers = TimerWheel()
+        self._output = None
+        self.name = kwargs.get('port_name') or self.PORT_NAME
+        self._keys = _input_keys(controller_cls)
+        self._led_index = {key: i for i, key in enumerate(self._all_leds())}
+
+        self._ring_shm = shared_memory.SharedMemory(create=True, size=_RING_HEADER + RING_SIZE * _EVENT_SIZE)
+        self._fb_shm = shared_memory.SharedMemory(create=True, size=len(self._led_index) * 2)
+        # Both start zeroed
+        self._ring_header = self._ring_shm.buf[:_RING_HEADER].cast('Q')
+        self._fb = self._fb_shm.buf[:len(self._led_index) * 2].cast('H')
+
+        events_recv, events_send = multiprocessing.Pipe(duplex=False)
+        self._leds_recv, self._leds_send = multiprocessing.Pipe(duplex=False)
+        self._events = events_recv
+        self.process = multiprocessing.Process(
+            target=_io_main,
+            args=(controller_cls, args, kwargs, self._ring_shm, self._fb_shm, events_send, self._leds_recv),
+            daemon=True,
+        )
+        self.process.start()
+        self._closed = False
+        self._reader = threading.Thread(target=self._read_ring, daemon=True)
+        self._reader.start()
+
+    def _read_ring(self):
+        read = 0
+        ring = self._ring_shm.buf
+        try:
+            while True:
+                self._events.recv_bytes()
+                written = self._ring_header[0]
+                if written == read:
+                    continue
+                while read < written:
+                    t, idx, value = _EVENT.unpack_from(ring, _RING_HEADER + (read % RING_SIZE) * _EVENT_SIZE)
+                    self._queue.put((t, (idx, value)))
+                    read += 1
+                self._ring_header[1] = read
+                for listener in self._listeners:
+                    listener()
+        except (EOFError, OSError, ValueError):
+            # The I/O process exited, or close()
+            return
+
+    def _decode(self, data):
+        idx, value = data
+        return self._keys[idx] + (value,)
+
+    def _get_color(self, color):
+        # Colors are compiled in the I/O process, the LED state here is kept
+        # as the color specs
+        return color
+
+    def _color_id(self, color):
+        try:
+            return self._color_ids[color]
+        except KeyError:
+            pass
+        if len(self._color_ids) >= _MAX_COLORS:
+            # Out of ids, start again and rewrite the framebuffer with the new ids
+            self._color_ids.clear()
+            self._leds_send.send(('reset_colors',))
+            for i in range(len(self._fb)):
+                self._fb[i] = 0
+            for key, spec in self._leds.items():
+                self._fb[self._led_index[key]] = self._color_id(spec)
+        color_id = self._color_ids[color] = len(self._color_ids) + 1
+        self._leds_send.send(('color', color_id, color))
+        return color_id
+
+    def _set_compiled(self, group, control, color):
+        key = (group, control)
+        if self._leds.get(key) == color:
+            if self.stats is not None:
+                self.stats.redundant += 1
+            return
+        try:
+            idx = self._led_index[key]
+        except KeyError:
+            raise ValueError(f"{group} {control} has no LED") from None
+        self._fb[idx] = self._color_id(color)
+        self._leds[key] = color
+        if self._batch_depth:
+            self._batch[key] = color
+        else:
+            self._leds_send.send(('flush',))
+
+    def _flush(self, pending):
+        self._leds_send.send(('flush',))
+
+    def invalidate(self):
+        self._leds.clear()
+        self._leds_send.send(('invalidate',))
+
+    def send(self, type_, **kwargs):
+        raise NotImplementedError("Messages can't be sent directly from the application process")
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            self._leds_send.send(('close',))
+        except OSError:
+            pass
+        self.process.join(5)
+        self._events.close()
+        self._reader.join(1)
+        self._ring_header.release()
+        self._fb.release()
+        for shm in (self._ring_shm, self._fb_shm):
+            shm.close()
+            shm.unlink()
+
+
+_PROXY_CLASSES = {}
+
+
+def spawn(controller_cls, *args, **kwargs):
+    # Start controller_cls(*args, **kwargs) in a new process, returns the
+    # ProcessController to use in its place
+    try:
+        proxy_cls = _PROXY_CLASSES[controller_cls]
+    except KeyError:
+        # A class per controller type, as things like ControlSet expansion are
+        # cached by type
+        attrs = {
+            name: getattr(controller_cls, name)
+            for name in ('PORT_NAME', 'HAS_FEEDBACK', 'HAS_GRID', '_BTN_MAP', '_GRID_SIZE', '_CONTINUOUS_GROUPS')
+            if hasattr(controller_cls, name)
+        }
+        proxy_cls = _PROXY_CLASSES[controller_cls] = type('Process' + controller_cls.__name__, (ProcessController,), attrs)
+    return proxy_cls(controller_cls, *args, **kwargs)
@@ -0,0 +1,170 @@
+import cProfile
+import difflib
+import gzip
+import pstats
+import struct
+import threading
+import time
+
+
+# Session recordings: a header followed by one record per message,
+# (direction, microseconds since start, length) and then the message bytes.
+# Paths ending in .gz are compressed.
+
+MAGIC = b'MSREC2\n'
+INPUT = 0
+OUTPUT = 1
+_RECORD = struct.Struct('<BQH')
+# Recordings from before the times were 64 bit, which wrapped after 71 minutes
+_MAGIC_V1 = b'MSREC1\n'
+_RECORD_V1 = struct.Struct('<BIH')
+
+
+def _open(path, mode):
+    if path.endswith('.gz'):
+        return gzip.open(path, mode)
+    return open(path, mode)
+
+
+class Recorder:
+    # Records a controller's input (as it arrives) and output (as it is sent)
+    #   with Recorder('show.msrec', controller):
+    #       viewset.run()
+
+    def __init__(self, path, controller=None):
+        self.fp = _open(path, 'wb')
+        self.fp.write(MAGIC)
+        self.lock = threading.Lock()
+        self.start = time.monotonic()
+        self.controller = None
+        if controller is not None:
+            self.attach(controller)
+
+    def attach(self, controller):
+        self.controller = controller
+        controller.recorder = self
+
+    def record(self, direction, data, timestamp=None):
+        timestamp = time.monotonic() if timestamp is None else timestamp
+        data = bytes(data)
+        with self.lock:
+            if self.fp is None:
+                return
+            self.fp.write(_RECORD.pack(direction, max(0, int((timestamp - self.start) * 1e6)), len(data)))
+            self.fp.write(data)
+
+    def close(self):
+        if self.controller is not None and self.controller.recorder is self:
+            self.controller.recorder = None
+        with self.lock:
+            if self.fp is not None:
+                self.fp.close()
+                self.fp = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def load(path):
+    # [(direction, seconds since start, bytes), ...]
+    out = []
+    with _open(path, 'rb') as fp:
+        magic = fp.read(len(MAGIC))
+        if magic == MAGIC:
+            record = _RECORD
+        elif magic == _MAGIC_V1:
+            record = _RECORD_V1
+        else:
+            raise ValueError("Not a midisurface recording: " + path)
+        while True:
+            header = fp.read(record.size)
+            if len(header) < record.size:
+                break
+            direction, us, length = record.unpack(header)
+            out.append((direction, us / 1e6, fp.read(length)))
+    return out
+
+
+class ReplayReport:
+    def __init__(self):
+        self.messages = 0
+        self.elapsed = 0
+        self.latencies = []
+        self.recorded_output = []
+        self.replayed_output = []
+        self.profile = None
+
+    @property
+    def throughput(self):
+        return (self.messages / self.elapsed) if self.elapsed else 0
+
+    def latency(self, percentile=50):
+        if not self.latencies:
+            return 0
+        latencies = sorted(self.latencies)
+        return latencies[min(len(latencies) - 1, int(len(latencies) * percentile / 100))]
+
+    def output_diff(self, limit=None):
+        # [(tag, recorded index, recorded messages, replayed index, replayed
+        # messages), ...] for each run of output that differs from the
+        # recording, tag is 'replace', 'delete' (only recorded) or 'insert'
+        # (only replayed). Aligned with difflib, so one extra or missing
+        # message doesn't make everything after it differ.
+        out = []
+        matcher = difflib.SequenceMatcher(None, self.recorded_output, self.replayed_output, autojunk=False)
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+            if tag == 'equal':
+                continue
+            out.append((tag, i1, self.recorded_output[i1:i2], j1, self.replayed_output[j1:j2]))
+            if limit and len(out) >= limit:
+                break
+        return out
+
+    def __str__(self):
+        out = [
+            f"{self.messages} messages in {self.elapsed:.3f}s ({self.throughput:.0f}/s)",
+            f"dispatch latency p50 {self.latency(50) * 1e6:.1f}us p99 {self.latency(99) * 1e6:.1f}us max {self.latency(100) * 1e6:.1f}us",
+            f"output: {len(self.recorded_output)} recorded, {len(self.replayed_output)} replayed, {sum(max(len(rec), len(rep)) for _, _, rec, _, rep in self.output_diff())} differ",
+        ]
+        return '\n'.join(out)
+
+
+def replay(path, viewset, speed=None, profile=False):
+    # Feed a recording's input through viewset, whose controller must be
+    # using a new VirtualPort; everything it has sent is compared to the
+    # recorded output, so set up views the same way as when recording.
+    # speed=1 is real time, 2 twice as fast etc., None as fast as possible.
+    # With profile, report.profile is a pstats.Stats of the dispatch.
+    records = load(path)
+    inputs = [(timestamp, data) for direction, timestamp, data in records if direction == INPUT]
+    controller = viewset.controller
+    port = controller.port
+    report = ReplayReport()
+    report.recorded_output = [data for direction, _, data in records if direction == OUTPUT]
+
+    profiler = cProfile.Profile() if profile else None
+    start = time.monotonic()
+    for timestamp, data in inputs:
+        if speed:
+            delay = (start + (timestamp / speed)) - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        t = time.perf_counter()
+        if profiler:
+            profiler.enable()
+        port.feed_raw(data)
+        viewset.dispatch()
+        if profiler:
+            profiler.disable()
+        report.latencies.append(time.perf_counter() - t)
+        report.messages += 1
+    report.elapsed = time.monotonic() - start
+
+    controller.flush_output()
+    report.replayed_output = [bytes(data) for data in port.sent]
+    if profiler:
+        report.profile = pstats.Stats(profiler)
+    return report
@@ -0,0 +1,179 @@
+import time
+
+
+# Timing of the dispatch and LED output paths, for finding where the time
+# goes when a surface feels slow:
+#   stats = Stats(controller, interval=5)
+#   viewset.add_ticker(stats)  # print a summary every 5 seconds
+# Nothing is measured while no Stats is attached to the controller.
+
+STAGES = (
+    # Message arrival (in the MIDI thread) to being read by get_messages
+    'queue',
+    # Raw bytes to (group, control, value)
+    'decode',
+    # View.dispatch of one message, including its callbacks
+    'dispatch',
+    # ViewSet.render
+    'render',
+    # Writing (or queueing, with threaded_output) the messages for one update
+    'send',
+)
+
+
+class Histogram:
+    # Durations in power of two buckets of microseconds
+    def __init__(self):
+        self.buckets = [0] * 32
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def add(self, seconds):
+        self.buckets[min(31, int(seconds * 1e6).bit_length())] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    @property
+    def mean(self):
+        return (self.total / self.count) if self.count else 0
+
+    def percentile(self, percentile):
+        # Upper bound of the bucket the percentile falls in, in seconds
+        if not self.count:
+            return 0
+        target = self.count * percentile / 100
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if n and seen >= target:
+                return min(self.max, (1 << i) / 1e6)
+        return self.max
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'mean': self.mean,
+            'p50': self.percentile(50),
+            'p99': self.percentile(99),
+            'max': self.max,
+        }
+
+
+def _callback_name(callback):
+    # Offloaded callbacks are reported under the function they run
+    callback = getattr(callback, 'callback', callback)
+    return getattr(callback, '__qualname__', None) or repr(callback)
+
+
+class Stats:
+    def __init__(self, controller=None, interval=None, output=print):
+        # interval, output: when added to a ViewSet as a ticker, call output
+        # with a summary every interval seconds
+        self.interval = interval
+        self.output = output
+        self.controllers = []
+        self.reset()
+        self.next_dump = (self.start + interval) if interval else None
+        if controller is not None:
+            self.attach(controller)
+
+    def reset(self):
+        self.start = time.monotonic()
+        self.stages = {stage: Histogram() for stage in STAGES}
+        # (control name, event, callback) -> Histogram
+        self.callbacks = {}
+        self.messages = 0
+        self.max_queue_depth = 0
+        self.led_messages = 0
+        # set_color calls for a color the LED already had, so nothing was sent
+        self.redundant = 0
+        self.errors = 0
+        self._last_dump = (self.start, 0)
+
+    def attach(self, controller):
+        self.controllers.append(controller)
+        controller.stats = self
+
+    def detach(self, controller=None):
+        for c in ([controller] if controller is not None else list(self.controllers)):
+            if c.stats is self:
+                c.stats = None
+            self.controllers.remove(c)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.detach()
+
+    def _input(self, arrived, read, depth):
+        self.stages['queue'].add(read - arrived)
+        self.messages += 1
+        if depth > self.max_queue_depth:
+            self.max_queue_depth = depth
+
+    def _callback(self, ctrl_instance, event, callback, seconds):
+        key = (ctrl_instance.name, event, callback)
+        try:
+            hist = self.callbacks[key]
+        except KeyError:
+            hist = self.callbacks[key] = Histogram()
+        hist.add(seconds)
+
+    def _send(self, count, seconds):
+        self.led_messages += count
+        self.stages['send'].add(seconds)
+
+    @property
+    def led_rate(self):
+        # LED messages per second since reset()
+        elapsed = time.monotonic() - self.start
+        return (self.led_messages / elapsed) if elapsed else 0
+
+    def snapshot(self):
+        return {
+            'elapsed': time.monotonic() - self.start,
+            'messages': self.messages,
+            'max_queue_depth': self.max_queue_depth,
+            'led_messages': self.led_messages,
+            'led_rate': self.led_rate,
+            'redundant': self.redundant,
+            'errors': self.errors,
+            'stages': {stage: hist.as_dict() for stage, hist in self.stages.items()},
+            'callbacks': [
+                dict(control=name, event=event, callback=_callback_name(cb), **hist.as_dict())
+                for (name, event, cb), hist in self.callbacks.items()
+            ],
+        }
+
+    def __str__(self):
+        now = time.monotonic()
+        last_time, last_leds = self._last_dump
+        rate = ((self.led_messages - last_leds) / (now - last_time)) if now > last_time else 0
+        out = [
+            f"{self.messages} messages, max queue depth {self.max_queue_depth}, {self.errors} callback errors",
+            f"{self.led_messages} LED messages ({rate:.0f}/s), {self.redundant} redundant writes skipped",
+            f"{'stage':40} {'count':>8} {'mean us':>10} {'p50 us':>10} {'p99 us':>10} {'max us':>10}",
+        ]
+        rows = [(stage, hist) for stage, hist in self.stages.items()]
+        rows += sorted(
+            ((f"{name}.{event} {_callback_name(cb)}", hist) for (name, event, cb), hist in self.callbacks.items()),
+            key=lambda row: -row[1].total,
+        )
+        for label, hist in rows:
+            out.append(f"{label[:40]:40} {hist.count:8} {hist.mean * 1e6:10.1f} {hist.percentile(50) * 1e6:10.1f} {hist.percentile(99) * 1e6:10.1f} {hist.max * 1e6:10.1f}")
+        return '\n'.join(out)
+
+    def dump(self):
+        self.output(str(self))
+        self._last_dump = (time.monotonic(), self.led_messages)
+
+    def next_deadline(self):
+        return self.next_dump
+
+    def tick(self, now):
+        self.next_dump = now + self.interval
+        self.dump()
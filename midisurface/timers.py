@@ -0,0 +1,95 @@
+import math
+import time
+
+
+class Timer:
+    __slots__ = ('wheel', 'when', 'tick', 'callback', 'args', 'slot')
+
+    def __init__(self, wheel, when, callback, args):
+        self.wheel = wheel
+        self.when = when
+        self.callback = callback
+        self.args = args
+        self.tick = None
+        # The wheel slot (or batch of due timers) it's in, None once fired or
+        # cancelled
+        self.slot = None
+
+    @property
+    def pending(self):
+        return self.slot is not None
+
+    def cancel(self):
+        if self.slot is not None:
+            del self.slot[self]
+            self.slot = None
+            self.wheel.pending -= 1
+
+
+class TimerWheel:
+    # Hashed timer wheel, so arming and cancelling a timer are O(1) however
+    # many are pending. Timers fire from tick(), up to resolution seconds
+    # late; it's a ViewSet ticker (every ViewSet runs its controller's
+    # controller.timers), so callbacks run on the dispatch thread. Only arm
+    # timers from that thread, e.g. from control callbacks.
+
+    def __init__(self, resolution=0.01, slots=256):
+        self.resolution = resolution
+        # Each slot is a dict used as an ordered set of Timers
+        self.slots = [{} for _ in range(slots)]
+        # Last tick number processed
+        self.current = None
+        self.pending = 0
+
+    def __len__(self):
+        return self.pending
+
+    def call_at(self, when, callback, *args):
+        # callback(*args) at time.monotonic() time when, returns a Timer that
+        # can be cancelled
+        if self.current is None or not self.pending:
+            self.current = int(time.monotonic() / self.resolution)
+        timer = Timer(self, when, callback, args)
+        timer.tick = max(self.current + 1, math.ceil(when / self.resolution))
+        timer.slot = self.slots[timer.tick % len(self.slots)]
+        timer.slot[timer] = None
+        self.pending += 1
+        return timer
+
+    def call_later(self, delay, callback, *args):
+        return self.call_at(time.monotonic() + delay, callback, *args)
+
+    def next_deadline(self):
+        if not self.pending:
+            return None
+        return (self.current + 1) * self.resolution
+
+    def tick(self, now):
+        target = int(now / self.resolution)
+        if self.current is None or target <= self.current:
+            return
+        # After a long gap every slot has to be looked at, but only once
+        ticks = range(self.current + 1, target + 1)
+        if len(ticks) > len(self.slots):
+            ticks = ticks[-len(self.slots):]
+        self.current = target
+
+        due = []
+        for t in ticks:
+            slot = self.slots[t % len(self.slots)]
+            if not slot:
+                continue
+            for timer in [timer for timer in slot if timer.tick <= target]:
+                del slot[timer]
+                due.append(timer)
+        if not due:
+            return
+        # Still cancellable until it fires, e.g. by an earlier callback
+        due.sort(key=lambda timer: timer.when)
+        due = dict.fromkeys(due)
+        for timer in due:
+            timer.slot = due
+        while due:
+            timer = next(iter(due))
+            timer.cancel()
+            timer.callback(*timer.args)
@@ -1,39 +1,131 @@
+import asyncio
+import time
+
+from .control import ControlSet, GridControlSet
+
+
 class ViewSet:
     def __init__(self, controller):
         self.controller = controller
         self.view_stack = []
+        # Objects with next_deadline() (a time.monotonic() time, or None) and
+        # tick(now), run from the dispatch loop, e.g. animation.Animator
+        self.tickers = [controller.timers]
+
+    def add_ticker(self, ticker):
+        self.tickers.append(ticker)
+        # Have a blocked run() recalculate how long to wait
+        self.controller.wake()
+
+    def remove_ticker(self, ticker):
+        if ticker in self.tickers:
+            self.tickers.remove(ticker)
+
+    def _next_deadline(self):
+        deadline = None
+        for ticker in self.tickers:
+            t = ticker.next_deadline()
+            if t is not None and (deadline is None or t < deadline):
+                deadline = t
+        return deadline
+
+    def _run_tickers(self):
+        if not self.tickers:
+            return
+        now = time.monotonic()
+        for ticker in list(self.tickers):
+            t = ticker.next_deadline()
+            if t is not None and t <= now:
+                ticker.tick(now)
+
+    def _wait_time(self, timeout):
+        deadline = self._next_deadline()
+        if deadline is None:
+            return timeout
+        until = max(0, deadline - time.monotonic())
+        return until if timeout is None else min(timeout, until)
 
     def render(self):
+        stats = self.controller.stats
+        if stats is not None:
+            t = time.perf_counter()
+        with self.controller.batch():
+            if self.view_stack:
+                self.view_stack[-1].render(self.controller)
+            else:
+                self.controller.reset()
+        if stats is not None:
+            stats.stages['render'].add(time.perf_counter() - t)
+
+    def _leave(self):
         if self.view_stack:
-            self.view_stack[-1].render(self.controller)
-        else:
-            self.controller.reset()
+            # Its controls won't see the releases now
+            for ctrl_instance in self.view_stack[-1].controls:
+                if ctrl_instance._timers:
+                    ctrl_instance.cancel_gestures()
+
+    def _enter(self):
+        # Rendered from the controls' current state, in one batch; the LED
+        # shadow means only the LEDs that differ from what's showing are sent
+        self.render()
 
     def push(self, view):
+        self._leave()
         self.view_stack.append(view)
-        self.render()
+        self._enter()
 
     def pop(self, view=None):
+        self._leave()
         while self.view_stack:
             if view is None:
                 self.view_stack.pop()
-                self.render()
-                return
-            else:
-                if self.view_stack and self.view_stack[-1] is view:
-                    self.render()
-                    return
-                self.view_stack.pop()
-        self.render()
+                break
+            elif self.view_stack[-1] is view:
+                break
+            self.view_stack.pop()
+        self._enter()
 
-    def dispatch(self):
-        for group, control, value in self.controller.get_messages():
+    def dispatch(self, timeout=0, coalesce=False):
+        for group, control, value in self.controller.get_messages(timeout, coalesce):
             if self.view_stack:
-                self.view_stack[-1].dispatch(self.controller, group, control, value)
+                stats = self.controller.stats
+                if stats is None:
+                    self.view_stack[-1].dispatch(self.controller, group, control, value)
+                else:
+                    t = time.perf_counter()
+                    self.view_stack[-1].dispatch(self.controller, group, control, value)
+                    stats.stages['dispatch'].add(time.perf_counter() - t)
 
-    def run(self):
+    def run(self, timeout=None, on_tick=None, coalesce=False):
+        # Sleeps until a message arrives or a ticker is due; with a timeout,
+        # on_tick is also called at least every timeout seconds
         while True:
-            self.dispatch()
+            self.dispatch(self._wait_time(timeout), coalesce)
+            self._run_tickers()
+            if on_tick:
+                on_tick(self)
+
+    async def run_async(self, coalesce=False):
+        loop = asyncio.get_running_loop()
+        event = asyncio.Event()
+
+        def notify():
+            loop.call_soon_threadsafe(event.set)
+
+        self.controller._listeners.append(notify)
+        try:
+            while True:
+                event.clear()
+                self.dispatch(0, bool(coalesce))
+                self._run_tickers()
+                try:
+                    await asyncio.wait_for(event.wait(), self._wait_time(None))
+                except asyncio.TimeoutError:
+                    pass
+                if event.is_set() and coalesce and coalesce is not True:
+                    await asyncio.sleep(coalesce)
+        finally:
+            self.controller._listeners.remove(notify)
 
 
 class View:
@@ -41,10 +133,41 @@ class View:
         self.name = name
         self.controls = controls
 
+    @property
+    def controls(self):
+        return self._controls
+
+    @controls.setter
+    def controls(self, controls):
+        self._controls = tuple(controls)
+        self._reset_routes()
+
+    def _reset_routes(self):
+        # (group, control) -> controls that handle it, filled in as messages
+        # arrive and rebuilt if any ControlSet has changed since
+        self._routes = {}
+        self._routes_changes = ControlSet._changes
+        for ctrl_instance in self._controls:
+            if isinstance(ctrl_instance.controls, GridControlSet):
+                for group, control in ctrl_instance.controls.cells():
+                    self._route(group, control)
+
+    def _route(self, group, control):
+        key = (group, control)
+        try:
+            return self._routes[key]
+        except KeyError:
+            pass
+        routes = self._routes[key] = tuple(c for c in self._controls if c.controls.test(group, control))
+        return routes
+
     def dispatch(self, controller, group, control, value):
-        for ctrl_instance in self.controls:
-            ctrl_instance.dispatch(controller, group, control, value)
+        if self._routes_changes != ControlSet._changes:
+            self._reset_routes()
+        for ctrl_instance in self._route(group, control):
+            ctrl_instance._dispatch(controller, group, control, value)
 
     def render(self, controller):
-        for ctrl_instance in self.controls:
-            ctrl_instance.render(controller)
\ No newline at end of file
+        with controller.batch():
+            for ctrl_instance in self.controls:
+                ctrl_instance.render(controller)
\ No newline at end of file